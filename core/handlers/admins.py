@@ -5,6 +5,7 @@
 import asyncio
 import contextlib
 import os
+import time
 from datetime import date, timedelta
 
 import requests
@@ -12,8 +13,11 @@ from aiogram import F, Router
 from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, BufferedInputFile, InputMediaPhoto, CallbackQuery, ReactionTypeEmoji
 
+from core.misc.apis import APIs, pool
 from core.misc.texts import Texts
-from core.misc.utils import get_date, pluralization_string
+from core.misc.upstream import Upstream
+from core.misc.utils import get_date, pluralization_string, get_week_for_date
+from core.services.api import UserData
 from core.services.database import database
 
 import plotly.graph_objs as go
@@ -111,11 +115,7 @@ async def statistics(message: Message):
             media=BufferedInputFile(x, filename="plot.png"),
             show_caption_above_media=True,
             caption=Texts.Admin.STATISTICS(
-                len([
-                    user_id
-                    for user_id in database.keys()
-                    if user_id.isdigit() and database.user(user_id).system
-                ]),
+                len(database.select_users()),
                 database.settings.get(f"new-users-month:{date.today().month}", 0),
                 pluralization_string(len([
                     user
@@ -182,11 +182,11 @@ async def start_notify(callback: CallbackQuery, message, command: CommandObject)
             users_ids_raw = args[args.index(arg) + 1]
             users_ids = [int(user_id) for user_id in users_ids_raw.split(",")]
         elif arg in ["-na", "--not-authorized"]:
+            authorized = set(database.select_users(authorized=True))
             users_ids = [
                 user_id
                 for user_id in database.settings.get("full-users-ids", [])
-                if user_id not in database.keys()
-                or not database.user(user_id).token
+                if str(user_id) not in authorized
             ]
 
     _message = await callback.message.edit_text(
@@ -197,8 +197,7 @@ async def start_notify(callback: CallbackQuery, message, command: CommandObject)
     successfully_sent = 0
     for user in [
         int(user_id)
-        for user_id in database.keys()
-        if user_id.isdigit() and database.user(user_id).system and int(user_id) not in database.blocked_users
+        for user_id in database.select_users(system=system or None, blocked=False)
     ] if not users_ids else users_ids:
         if system and database.user(str(user)).system != system:
             continue
@@ -221,7 +220,117 @@ async def start_notify(callback: CallbackQuery, message, command: CommandObject)
     )
 
 
+def format_size(size: int) -> str:
+    for unit in ("Б", "КБ", "МБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+@router.message(Command("cache_stats"), AdminFilter)
+async def cache_stats(message: Message):
+    stats = await database.cache_stats()
+    decoded = Texts.Admin.CACHE_STATS_DECODED(
+        SIZE=len(UserData.decoded),
+        HITS=UserData.decoded.hits,
+        MISSES=UserData.decoded.misses
+    )
+    if not stats:
+        await message.answer(Texts.Admin.CACHE_STATS_EMPTY + decoded)
+        return
+
+    keys_word = ["ключ", "ключа", "ключей"]
+    await message.answer(
+        Texts.Admin.CACHE_STATS(
+            ITEMS="\n".join(
+                Texts.Admin.CACHE_STATS_ITEM(
+                    NAME=name,
+                    KEYS=pluralization_string(keys, keys_word),
+                    MEMORY=format_size(memory)
+                )
+                for name, (keys, memory) in sorted(stats.items(), key=lambda item: item[1][1], reverse=True)
+            ),
+            KEYS=pluralization_string(sum(keys for keys, _ in stats.values()), keys_word),
+            MEMORY=format_size(sum(memory for _, memory in stats.values()))
+        ) + decoded
+    )
+
+
+@router.message(Command("pool_stats"), AdminFilter)
+async def pool_stats(message: Message):
+    stats = pool.stats()
+    await message.answer(
+        Texts.Admin.POOL_STATS(
+            CLIENTS=len(APIs.registry),
+            ACQUIRED=stats["acquired"],
+            LIMIT=stats["limit"],
+            LIMIT_PER_HOST=stats["limit_per_host"],
+            IDLE=stats["idle"],
+            REQUESTS=stats["requests"],
+            DATA_REQUESTS=UserData.single_flight["requests"],
+            COALESCED=UserData.single_flight["coalesced"],
+            FRESH=UserData.single_flight["fresh"]
+        )
+    )
+
+
+@router.message(Command("upstreams"), AdminFilter)
+async def upstreams(message: Message):
+    if not Upstream.registry:
+        return await message.answer(Texts.Admin.UPSTREAMS_EMPTY)
+
+    items = []
+    for upstream in Upstream.registry.values():
+        state, stats = upstream.breaker.state, upstream.breaker.stats()
+        items.append(Texts.Admin.UPSTREAMS_ITEM(
+            STATE=getattr(Texts.Admin.UpstreamStates, state)(RETRY_IN=round(upstream.breaker.retry_in)),
+            NAME=upstream.name,
+            REQUESTS=stats["requests"],
+            ERRORS=round(stats["errors"] * 100),
+            SLOW=round(stats["slow"] * 100),
+            REJECTED=upstream.breaker.rejected,
+            LIMIT=int(upstream.limiter.limit),
+            IN_FLIGHT=upstream.limiter.in_flight,
+            WAITING=upstream.limiter.waiting,
+            RETRIES=upstream.retries,
+            HEDGED=upstream.hedged,
+            P95="—" if upstream.latencies.p95 is None else round(upstream.latencies.p95, 2)
+        ))
+
+    await message.answer(Texts.Admin.UPSTREAMS(ITEMS="\n".join(items)))
+
+
+@router.message(Command("load_benchmark"), AdminFilter)
+async def load_benchmark(message: Message, command: CommandObject):
+    user = database.user(command.args.strip() if command.args else message.from_user.id)
+    if not user.token:
+        return await message.answer(Texts.Admin.LOAD_BENCHMARK_NO_TOKEN)
+
+    offset = user.db_settings.get("weeks_offset", 2)
+    weeks = [get_week_for_date(get_date() + timedelta(weeks=i)) for i in range(-offset, offset + 1)]
+    user_data = UserData(user, user.apis)
+
+    items = []
+    for name in UserData.WIDE_RANGE:
+        results = {}
+        for wide in (False, True):
+            started = time.perf_counter()
+            results[wide] = (await user_data.load_weeks(name, weeks, None, wide=wide), time.perf_counter() - started)
+
+        items.append(Texts.Admin.LOAD_BENCHMARK_ITEM(
+            NAME=name.value,
+            WEEKS=len(weeks),
+            PER_WEEK=f"{results[False][1]:.2f}",
+            WIDE=f"{results[True][1]:.2f}",
+            SAME="✅" if results[False][0] == results[True][0] else "❌"
+        ))
+
+    await message.answer(Texts.Admin.LOAD_BENCHMARK(SYSTEM=user.system, ITEMS="\n".join(items)))
+
+
 @router.message(Command("shutdown"), AdminFilter)
 async def shutdown(message: Message):
     await message.react([ReactionTypeEmoji(emoji="👌")])
+    database.close()
     os._exit(0) # noqa
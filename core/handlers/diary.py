@@ -3,7 +3,9 @@
 #        https://opensource.org/licenses/MIT
 #           https://github.com/OctoDiary
 
+import asyncio
 import datetime
+import os
 import random
 import re
 import time
@@ -13,20 +15,157 @@ from datetime import timedelta
 
 from aiogram import Router, F, types, Bot
 from aiogram.filters import Command, CommandObject
-from octodiary.types.mobile import SubjectsMarks, Marks, EventsResponse, LessonScheduleItem
+from loguru import logger
+from octodiary.types.mobile import SubjectsMarks, LessonScheduleItem
 from pydantic import BaseModel
 
 from core.keyboards.inline import DIARY, BACK_BUTTON, CALC_MARKS
-from core.misc.additional_models import MarkInfo, Homeworks, HomeworkItem
+from core.misc.additional_models import MarkInfo, HomeworkItem
+from core.misc.lru import LRUCache
 from core.misc.texts import Texts
-from core.misc.utils import get_date, get_week_for_date, MONTH_NAME_NUMERALS, pluralization_string, start_with_args, \
-    fmark, chunks, WEEKDAY, escape_html, parse_time, parse_date_iso, send_message
+from core.misc.upstream import Upstream, CLOSED
+from core.misc.utils import get_date, get_datetime, get_week_for_date, MONTH_NAME_NUMERALS, pluralization_string, start_with_args, \
+    fmark, chunks, WEEKDAY, escape_html, parse_time, parse_date_iso, send_message, TIMEZONE
 from core.services.api import UserData, DataType
 from core.services.database import database
 from core.misc.inline.types import AdditionalButtons
+from core.middlewares.renders import render_token, is_current_render
 
 router = Router(name="Diary")
 
+# Render diary weeks from cache and update them in background (stale-while-revalidate), if not set by the user
+DIARY_FROM_CACHE = os.environ.get("DIARY_FROM_CACHE", "0") == "1"
+
+# Prefetch of the weeks next to a rendered one: requests a minute per user (0 - disabled)
+# and seconds while a prefetched week is shown without a new request
+DIARY_PREFETCH_BUDGET = int(os.environ.get("DIARY_PREFETCH_BUDGET", 4))
+DIARY_PREFETCH_FRESHNESS = float(os.environ.get("DIARY_PREFETCH_FRESHNESS", 120))
+PREFETCH_SECTIONS = {
+    "marks_by_date": DataType.MARKS_BY_DATE,
+    "schedule": DataType.EVENTS,
+    "homeworks": DataType.HOMEWORKS,
+}
+_prefetch_budgets = LRUCache(4096)
+_prefetching: set[str] = set()
+_background_tasks: set[asyncio.Task] = set()
+
+
+def run_in_background(coroutine: typing.Coroutine) -> asyncio.Task:
+    """Run ``coroutine`` without waiting for it, keeping a reference to the task until it is done"""
+    task = asyncio.ensure_future(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def get_week(
+    user_data: UserData,
+    name: DataType,
+    week: list[datetime.date],
+    mode: str,
+    **kwargs
+) -> tuple[typing.Any, typing.Optional[datetime.datetime]]:
+    """
+    Data of the week for ``diary_week``: ``(response, loaded_at)``, ``loaded_at`` is set if it is from cache.
+
+    Modes:
+    ``live`` - from upstream, from cache if the request failed;
+    ``cache`` - from cache if there is one, otherwise as ``live``;
+    ``revalidate`` - from upstream, ``None`` if it failed or is the same as the cached one.
+    """
+    if mode == "cache":
+        response, loaded_at = await user_data.get_cached_week(name, week[0])
+        if response is not None:
+            return response, loaded_at
+
+    try:
+        response = await user_data.get(name, **kwargs)
+    except Exception:
+        if mode == "revalidate":
+            return None, None
+        return await user_data.get_cached_week(name, week[0])
+
+    if mode == "revalidate":
+        cached, _ = await user_data.get_cached_week(name, week[0])
+        # cached weeks lack fields excluded by ``UserData.WEEK_DUMP``, so they are compared as cached
+        if cached is not None and response is not None and (
+            UserData.dump_week(name, cached) == UserData.dump_week(name, response)
+        ):
+            return None, None
+
+    database.redis._queue.append(user_data.cache_week(name, week[0], response)) # noqa
+    return response, None
+
+
+def with_loaded_at(strings: dict[str, str], loaded_at: typing.Optional[datetime.datetime]) -> dict[str, str]:
+    if loaded_at is None:
+        return strings
+
+    loaded_at = loaded_at.astimezone(TIMEZONE)
+    marker = Texts.Diary.LOADED_AT(
+        loaded_at.strftime("%H:%M" if loaded_at.date() == get_date() else "%d.%m %H:%M")
+    )
+    return {key: marker + text for key, text in strings.items()}
+
+
+def take_prefetch_budget(user_id: str) -> bool:
+    """Token bucket of prefetch requests of the user: ``DIARY_PREFETCH_BUDGET`` a minute"""
+    now = time.monotonic()
+    tokens, updated = _prefetch_budgets.get(user_id) or (DIARY_PREFETCH_BUDGET, now)
+    tokens = min(DIARY_PREFETCH_BUDGET, tokens + (now - updated) * DIARY_PREFETCH_BUDGET / 60)
+    if tokens < 1:
+        _prefetch_budgets.set(user_id, (tokens, now))
+        return False
+
+    _prefetch_budgets.set(user_id, (tokens - 1, now))
+    return True
+
+
+async def prefetch_weeks(user_data: UserData, name: DataType, week: list[datetime.date]):
+    """
+    Warm the cache with the previous and the next weeks after ``week`` is rendered, so navigation is instant.
+    Prefetch requests are shared with the same in-flight ones (``UserData.get``) and skipped
+    when the user is out of budget or the upstream is busy or unavailable.
+    """
+    if user_data.db_user.id in _prefetching:
+        return
+
+    _prefetching.add(user_data.db_user.id)
+    try:
+        for adjacent in (week[0] - timedelta(weeks=1), week[0] + timedelta(weeks=1)):
+            upstream = Upstream.get(user_data.db_user.system)
+            if upstream.breaker.state != CLOSED or upstream.limiter.in_flight >= int(upstream.limiter.limit):
+                return
+
+            _, loaded_at = await user_data.get_cached_week(name, adjacent)
+            if loaded_at is not None and (
+                get_datetime() - loaded_at
+            ).total_seconds() < DIARY_PREFETCH_FRESHNESS:
+                continue
+
+            if not take_prefetch_budget(user_data.db_user.id):
+                return
+
+            adjacent_week = get_week_for_date(adjacent)
+            try:
+                response = await user_data.get(
+                    name,
+                    fresh=DIARY_PREFETCH_FRESHNESS,
+                    **UserData.range_kwargs(name, adjacent_week[0], adjacent_week[-1])
+                )
+            except Exception:
+                continue
+            await user_data.cache_week(name, adjacent, response)
+    finally:
+        _prefetching.discard(user_data.db_user.id)
+
+
+async def revalidate_week(call: types.CallbackQuery, bot: Bot, match: re.Match, render: int):
+    try:
+        await diary_week(call, bot, match, revalidate=True, render=render)
+    except Exception:
+        logger.exception(f"[Diary] Failed to revalidate {call.data} of {call.from_user.id}")
+
 
 @router.message(Command("diary", "d"))
 @router.message(F.text == Texts.Diary.COMMAND)
@@ -246,7 +385,14 @@ async def diary_week_update(call: types.CallbackQuery, bot: Bot):
 
 
 @router.callback_query(F.data.regexp(r"diary:(.*):(.*)").as_("match"), F.data.not_contains("upd"))
-async def diary_week(call: types.CallbackQuery, bot: Bot, match: re.Match, upd: bool = False):
+async def diary_week(
+    call: types.CallbackQuery,
+    bot: Bot,
+    match: re.Match,
+    upd: bool = False,
+    revalidate: bool = False,
+    render: typing.Optional[int] = None
+):
     user = database.user(call.from_user.id)
     user_data = UserData(user, user.apis)
     try:
@@ -267,22 +413,28 @@ async def diary_week(call: types.CallbackQuery, bot: Bot, match: re.Match, upd:
         week_date = datetime.date.fromisoformat(match.group(2))
         week = get_week_for_date(week_date)
 
+    mode = (
+        "revalidate" if revalidate
+        else "cache" if not upd and user.db_settings.get("diary_from_cache", DIARY_FROM_CACHE)
+        else "live"
+    )
+    # prefetched weeks are reused when navigating, but not on explicit updates
+    fresh = 0 if upd or revalidate else DIARY_PREFETCH_FRESHNESS
+    loaded_at = None
     match match.group(1):
         case "marks_by_date":
-            try:
-                response: Marks = await user_data.get(DataType.MARKS_BY_DATE, from_date=week[0], to_date=week[-1])
-            except: # noqa
-                cached: dict = await user_data.get_cached(DataType.MARKS_BY_DATE, raw=True) or {}
-                if not (r := cached.get(week[0].isoformat(), None)):
-                    ...
-                    return
+            response, loaded_at = await get_week(user_data, DataType.MARKS_BY_DATE, week, mode, fresh=fresh, from_date=week[0], to_date=week[-1])
+            if not response:
+                ...
+                return
 
-                response = Marks.model_validate(r)
-                cache = True
+            # the message could be switched to another week or page while revalidating
+            if revalidate and not is_current_render(call, render):
+                return
 
             await bot.inline.list(
                 update=call,
-                strings={
+                strings=with_loaded_at({
                     date.strftime("%d.%m"): Texts.Diary.BASE(
                         random.choice(Texts.Diary.EMOJIS)
                     ) + Texts.Diary.MarksByDate.TEXT(
@@ -307,7 +459,7 @@ async def diary_week(call: types.CallbackQuery, bot: Bot, match: re.Match, upd:
                         ])) or Texts.EMPTY(random.choice(["🫥", "😶‍🌫️", "😶", "🫠", "🫣"]))
                     )
                     for date in (week[:-1] if week[-1].isoformat() + '"' not in str(response) else week)
-                },
+                }, loaded_at),
                 additional_buttons=AdditionalButtons(
                     below_buttons=[
                         [
@@ -340,16 +492,10 @@ async def diary_week(call: types.CallbackQuery, bot: Bot, match: re.Match, upd:
                 await call.answer(Texts.UPDATED)
 
         case "schedule":
-            try:
-                response: EventsResponse = await user_data.get(DataType.EVENTS, begin_date=week[0], end_date=week[-1])
-            except: # noqa
-                cached: dict = await user_data.get_cached(DataType.EVENTS, raw=True) or {}
-                if not (r := cached.get(week[0].isoformat(), None)):
-                    ...
-                    return
-
-                response: EventsResponse = EventsResponse.model_validate(r)
-                cache = True
+            response, loaded_at = await get_week(user_data, DataType.EVENTS, week, mode, fresh=fresh, begin_date=week[0], end_date=week[-1])
+            if not response:
+                ...
+                return
 
             new_format: bool = user.db_settings.get("schedule_new_format", True)
             if new_format:
@@ -479,9 +625,12 @@ async def diary_week(call: types.CallbackQuery, bot: Bot, match: re.Match, upd:
                     for date in (week[:-1] if week[-1].isoformat() + '"' not in str(response) else week)
                 }
 
+            if revalidate and not is_current_render(call, render):
+                return
+
             await bot.inline.list(
                 update=call,
-                strings=strings,
+                strings=with_loaded_at(strings, loaded_at),
                 additional_buttons=AdditionalButtons(
                     below_buttons=[
                         [
@@ -517,16 +666,10 @@ async def diary_week(call: types.CallbackQuery, bot: Bot, match: re.Match, upd:
                 await call.answer(Texts.UPDATED)
 
         case "homeworks":
-            try:
-                response: Homeworks = await user_data.get(DataType.HOMEWORKS, from_date=week[0], to_date=week[-1])
-            except: # noqa
-                cached: dict = await user_data.get_cached(DataType.HOMEWORKS, raw=True) or {}
-                if not (r := cached.get(week[0].isoformat(), None)):
-                    ...
-                    return
-
-                response: Homeworks = Homeworks.model_validate(r)
-                cache = True
+            response, loaded_at = await get_week(user_data, DataType.HOMEWORKS, week, mode, fresh=fresh, from_date=week[0], to_date=week[-1])
+            if not response:
+                ...
+                return
 
             homeworks: dict[str, dict[str, list[HomeworkItem]]] = {}
             for hw in response.payload:
@@ -578,9 +721,12 @@ async def diary_week(call: types.CallbackQuery, bot: Bot, match: re.Match, upd:
                         ]
                     ] + items
 
+            if revalidate and not is_current_render(call, render):
+                return
+
             await bot.inline.list(
                 update=call,
-                strings={
+                strings=with_loaded_at({
                     date.strftime("%d.%m"): Texts.Diary.BASE(
                         random.choice(Texts.Diary.EMOJIS)
                     ) + Texts.Diary.Homeworks.TEXT(
@@ -622,7 +768,7 @@ async def diary_week(call: types.CallbackQuery, bot: Bot, match: re.Match, upd:
                         else ""
                     )
                     for date in (week[:-1] if week[-1].strftime("%d.%m") not in homeworks else week)
-                },
+                }, loaded_at),
                 additional_buttons=AdditionalButtons(
                     below_buttons=[
                         [
@@ -662,6 +808,14 @@ async def diary_week(call: types.CallbackQuery, bot: Bot, match: re.Match, upd:
             if await get_lesson_info(call, bot=bot, lesson_id=match.group(2).split("/")[0], lesson_type=match.group(2).split("/")[1]):
                 await call.answer(Texts.UPDATED)
 
+    if mode == "cache" and loaded_at is not None and (
+        get_datetime() - loaded_at
+    ).total_seconds() >= DIARY_PREFETCH_FRESHNESS:
+        run_in_background(revalidate_week(call, bot, match, render_token(call)))
+
+    if DIARY_PREFETCH_BUDGET and not revalidate and week and (name := PREFETCH_SECTIONS.get(match.group(1))):
+        run_in_background(prefetch_weeks(user_data, name, week))
+
 
 class Mark(BaseModel):
     value: int
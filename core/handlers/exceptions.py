@@ -76,13 +76,7 @@ async def message_middleware(
     data: Dict[str, Any]
 ):
     """Save user id in database"""
-    if (
-        message.chat.type == enums.ChatType.PRIVATE
-        and message.from_user.id not in database.settings.get("full-users-ids", [])
-    ):
-        database.settings.set(
-            "full-users-ids",
-            [*database.settings.get("full-users-ids", []), message.from_user.id]
-        )
+    if message.chat.type == enums.ChatType.PRIVATE:
+        database.settings.add("full-users-ids", message.from_user.id)
 
     return await handler(message, data)
@@ -4,7 +4,6 @@
 #           https://github.com/OctoDiary
 
 import os
-import pickle
 import random
 import re
 
@@ -18,6 +17,7 @@ from core.keyboards.reply import FEEDBACK_REASONS
 from core.misc.states import Feedback
 from core.misc.texts import Texts
 from core.misc.utils import send_message
+from core.services.codecs import codec
 from core.services.database import database
 
 router = Router(name="feedback")
@@ -188,13 +188,13 @@ async def save_media(message: types.Message):
         else getattr(message, message.content_type.lower()).file_id
     )
     if await database.redis.exists(str(message.media_group_id)):
-        data = pickle.loads(await database.redis.get(str(message.media_group_id)))
+        data = codec.decode(await database.redis.get(str(message.media_group_id)))
         data.append((message.content_type.lower(), file_id))
-        await database.redis.set(str(message.media_group_id), pickle.dumps(data), ex=3600 * 24 * 30)
+        await database.redis.set(str(message.media_group_id), codec.encode(data), ex=3600 * 24 * 30)
     else:
         await database.redis.set(
             str(message.media_group_id),
-            pickle.dumps([(message.content_type.lower(), file_id)]),
+            codec.encode([(message.content_type.lower(), file_id)]),
             ex=3600 * 24 * 30  # 30 days
         )
 
@@ -221,7 +221,7 @@ async def fanswer(message: types.Message, command: CommandObject, bot: Bot):
                 await message.react([types.ReactionTypeEmoji(emoji="🤨")])
                 return
 
-            data_media_group = pickle.loads(await database.redis.get(str(message.reply_to_message.media_group_id)))
+            data_media_group = codec.decode(await database.redis.get(str(message.reply_to_message.media_group_id)))
             await bot.send_media_group(
                 chat_id=data["user"],
                 media=[
@@ -14,6 +14,7 @@ import segno
 from aiogram import Router, F, types, Bot, enums
 from aiogram.filters import Command
 
+from core.handlers.diary import DIARY_FROM_CACHE
 from core.misc.texts import Texts
 from core.misc.utils import fmark, get_date, get_week_for_date, MONTH_NAME_NUMERALS, run_sync
 from core.services.api import UserData
@@ -46,7 +47,8 @@ SettingsScheme = {
                     get_section(["schedule", "homeworks", "marks"]),
                     get_section("weeks_offset"),
                     get_section("marks_separator"),
-                    get_section("week_format")
+                    get_section("week_format"),
+                    get_section("diary_from_cache")
                 ])
             )
         ),
@@ -211,6 +213,14 @@ SettingsScheme = {
                         ("week_format", "full")
                     )
                 }
+            ),
+            "from_cache": (
+                lambda user: (
+                    f"[{'✅' if user.db_settings.get('diary_from_cache', DIARY_FROM_CACHE) else '❎'}] "
+                    + Texts.Settings.Buttons.DIARY_FROM_CACHE
+                ),
+                None,
+                ("diary_from_cache", "not,True" if DIARY_FROM_CACHE else "not")
             )
         }, 0
     ),
@@ -0,0 +1,25 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram.types import TelegramObject
+
+from core.dispatcher import dispatcher
+from core.services.database import database
+
+
+@dispatcher.update.outer_middleware()
+async def batch_middleware(
+    handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+    event: TelegramObject,
+    data: Dict[str, Any]
+):
+    """Save all writes of the user made while handling the update at once"""
+    if (user := data.get("event_from_user")) is None:
+        return await handler(event, data)
+
+    with database.user(user.id).batch():
+        return await handler(event, data)
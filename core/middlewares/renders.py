@@ -0,0 +1,43 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import itertools
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from aiogram.types import CallbackQuery, TelegramObject
+
+from core.dispatcher import dispatcher
+from core.misc.lru import LRUCache
+
+_counter = itertools.count(1)
+_renders = LRUCache(4096)
+
+
+def message_key(call: CallbackQuery) -> Hashable:
+    if call.inline_message_id is not None:
+        return call.inline_message_id
+    return call.message.chat.id, call.message.message_id
+
+
+def render_token(call: CallbackQuery) -> int:
+    """Token of the last callback of the message of ``call``, it changes on every callback of the message"""
+    return _renders.get(message_key(call), 0)
+
+
+def is_current_render(call: CallbackQuery, token: int) -> bool:
+    """Whether the message of ``call`` wasn't used since ``token`` was taken (e.g. switched to another page)"""
+    return render_token(call) == token
+
+
+@dispatcher.callback_query.outer_middleware()
+async def renders_middleware(
+    handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+    event: CallbackQuery,
+    data: Dict[str, Any]
+):
+    """Change the render token of the message on every callback of it"""
+    if event.inline_message_id is not None or event.message is not None:
+        _renders.set(message_key(event), next(_counter))
+    return await handler(event, data)
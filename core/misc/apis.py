@@ -3,10 +3,184 @@
 #        https://opensource.org/licenses/MIT
 #           https://github.com/OctoDiary
 
+import contextlib
+import functools
+import json
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+import aiohttp
 from octodiary.apis import AsyncMobileAPI, AsyncWebAPI
+from octodiary.types import Type
+
+from core.misc.cassettes import cassettes
+
+
+class ClientPool:
+    """Shared aiohttp session with a connection pool (keep-alive, DNS cache) for all upstream requests"""
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        dns_ttl: int = 300,
+        keepalive_timeout: float = 30,
+    ) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.requests = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    ttl_dns_cache=self.dns_ttl,
+                    keepalive_timeout=self.keepalive_timeout,
+                )
+            )
+        return self._session
+
+    def stats(self) -> dict[str, int]:
+        """Pool utilization: connections in use, idle keep-alive connections and count of sent requests"""
+        connector = self._session.connector if self._session is not None and not self._session.closed else None
+        return {
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "acquired": len(getattr(connector, "_acquired", ())),
+            "idle": sum(map(len, getattr(connector, "_conns", {}).values())),
+            "requests": self.requests,
+        }
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+pool = ClientPool(limit_per_host=int(os.environ.get("HTTP_POOL_LIMIT_PER_HOST", 20)))
+
+_raw_responses: ContextVar[bool] = ContextVar("raw_responses", default=False)
+
+
+@contextlib.contextmanager
+def raw_responses():
+    """Requests of octodiary APIs return the response text instead of parsing it into models within the block"""
+    token = _raw_responses.set(True)
+    try:
+        yield
+    finally:
+        _raw_responses.reset(token)
+
+
+class PooledAPIMixin:
+    """Sends requests of octodiary APIs through the shared ``pool`` instead of a new session per request"""
+
+    @functools.cached_property
+    def user_agent(self) -> str:
+        # generating a random one on every request is slow
+        return super().user_agent
+
+    async def request(
+        self,
+        method: str,
+        base_url: str,
+        path: str,
+        custom_headers: Optional[dict] = None,
+        model: Optional[type[Type]] = None,
+        is_list: bool = False,
+        return_json: bool = False,
+        return_raw_text: bool = False,
+        required_token: bool = True,
+        return_raw_response: bool = False,
+        **kwargs
+    ):
+        params = kwargs.pop("params", {})
+        if cassettes.replaying and not return_raw_response:
+            raw_text = await cassettes.replay(method, base_url + path, params)
+            return self._parse(raw_text, model, is_list, return_json, return_raw_text)
+
+        pool.requests += 1
+        async with pool.session().request(
+            method=method,
+            url=self.init_params(base_url + path, params),
+            headers=self.headers(required_token, custom_headers),
+            **kwargs
+        ) as response:
+            await self._check_response(response)
+            raw_text = await response.text()
+            if return_raw_response and raw_text:
+                return response
+
+        if cassettes.recording and raw_text:
+            cassettes.record(method, base_url + path, params, raw_text)
+        return self._parse(raw_text, model, is_list, return_json, return_raw_text)
+
+    def _parse(
+        self,
+        raw_text: str,
+        model: Optional[type[Type]],
+        is_list: bool,
+        return_json: bool,
+        return_raw_text: bool,
+    ):
+        if not raw_text:
+            return None
+
+        if model and _raw_responses.get():
+            return raw_text
+
+        return (
+            json.loads(raw_text)
+            if return_json
+            else raw_text
+            if return_raw_text
+            else self.parse_list_models(model, raw_text)
+            if is_list
+            else model.model_validate_json(raw_text)
+            if model
+            else raw_text
+        )
+
+class PooledMobileAPI(PooledAPIMixin, AsyncMobileAPI):
+    pass
+
+
+class PooledWebAPI(PooledAPIMixin, AsyncWebAPI):
+    pass
 
 
 class APIs:
+    """
+    Upstream clients of a user.
+
+    Use ``APIs.get`` to reuse clients of the same ``(token, system)``, unused ones are dropped by ``evict``.
+    """
+
+    registry: dict[tuple[str, str], "APIs"] = {}
+
     def __init__(self, token: str, system: str) -> None:
-        self.mobile: AsyncMobileAPI = AsyncMobileAPI(token=token, system=system)
-        self.web: AsyncWebAPI = AsyncWebAPI(token=token, system=system)
+        self.mobile: AsyncMobileAPI = PooledMobileAPI(token=token, system=system)
+        self.web: AsyncWebAPI = PooledWebAPI(token=token, system=system)
+        self.last_used = time.monotonic()
+
+    @classmethod
+    def get(cls, token: str, system: str) -> "APIs":
+        if (apis := cls.registry.get((token, system))) is None:
+            apis = cls.registry[(token, system)] = cls(token, system)
+        apis.last_used = time.monotonic()
+        return apis
+
+    @classmethod
+    def evict(cls, idle: float = 600) -> int:
+        """Drop clients unused for ``idle`` seconds. Returns count of dropped ones."""
+        now = time.monotonic()
+        expired = [key for key, apis in cls.registry.items() if now - apis.last_used > idle]
+        for key in expired:
+            del cls.registry[key]
+        return len(expired)
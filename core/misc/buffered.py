@@ -0,0 +1,103 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import json
+import os
+import threading
+import time
+from typing import Any
+
+from lightdb import LightDB
+from loguru import logger
+
+
+class Flusher(threading.Thread):
+    """
+    Background thread which writes dirty stores to disk.
+
+    Stores marked dirty within ``interval`` seconds are written once, so bursts of writes
+    in handlers cost a single file write and never block the event loop.
+    """
+
+    def __init__(self, interval: float = 1.0, fsync: bool = False) -> None:
+        super().__init__(name="LightDBFlusher", daemon=True)
+        self.interval = interval
+        self.fsync = fsync
+        self._condition = threading.Condition()
+        self._dirty: dict[int, "BufferedLightDB"] = {}  # stores are dicts, so they aren't hashable
+
+    def mark_dirty(self, store: "BufferedLightDB") -> None:
+        with self._condition:
+            if not self.is_alive():
+                self.start()
+            self._dirty[id(store)] = store
+            self._condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._dirty:
+                    self._condition.wait()
+
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self) -> None:
+        """Write all dirty stores right now (also called on shutdown)"""
+        with self._condition:
+            stores, self._dirty = self._dirty, {}
+
+        for store in stores.values():
+            try:
+                store.write(fsync=self.fsync)
+            except Exception:
+                logger.exception(f"[Flusher] Failed to write {store.location}")
+                with self._condition:
+                    self._dirty[id(store)] = store
+
+
+flusher = Flusher(
+    interval=float(os.environ.get("DB_FLUSH_INTERVAL", 1)),
+    fsync=os.environ.get("DB_FSYNC", "0") == "1"
+)
+
+
+class BufferedLightDB(LightDB):
+    """LightDB which is saved by the background ``flusher`` instead of rewriting the file on every change"""
+
+    def __init__(self, location: str) -> None:
+        super().__init__(location)
+        self._write_lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        # LightDB.get copies the whole dict on every call
+        return dict.get(self, str(key), default)
+
+    def save(self) -> None:
+        flusher.mark_dirty(self)
+
+    def dump(self) -> str:
+        return json.dumps(self, ensure_ascii=False)
+
+    def write(self, fsync: bool = False) -> None:
+        """Atomically write the store to its file: temp file + rename"""
+        with self._write_lock:
+            for _ in range(3):
+                try:
+                    data = self.dump()
+                    break
+                except RuntimeError:
+                    # changed by the event loop thread during serialization
+                    continue
+            else:
+                data = self.dump()
+
+            tmp = self.location.with_name(self.location.name + ".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                f.write(data)
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp, self.location)
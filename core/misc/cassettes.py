@@ -0,0 +1,171 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import re
+import typing
+from contextvars import ContextVar
+
+from loguru import logger
+
+from core.misc.buffered import BufferedLightDB
+from core.misc.utils import get_date
+
+RECORD, REPLAY = "record", "replay"
+
+# Params identifying the user or authorizing requests, their values aren't written to cassettes
+SCRUBBED_PARAMS = frozenset({
+    "student_id", "person_id", "person_ids", "contract_id", "profile_id", "sso_id", "pid", "ids",
+    "school_id", "class_unit_id", "code", "code_verifier", "refresh_token", "client_id", "client_secret",
+})
+# Fields of responses with personal data or secrets
+SCRUBBED_FIELDS = frozenset({
+    "token", "access_token", "refresh_token", "id_token",
+    "first_name", "last_name", "middle_name", "short_name", "full_name", "user_name", "nickname",
+    "author_name", "contact_name", "contact_phone", "contact_email", "teacher_name",
+    "email", "phone", "phone_number", "mobile", "snils", "birth_date", "birthdate", "sex", "gender",
+    "address", "registration_address", "passport", "document_number", "photo", "avatar", "ip",
+    "guid", "person_guid", "contingent_guid", "sso_id", "user_id", "person_id", "student_id", "contract_id",
+})
+_GUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE)
+_DATE = re.compile(r"\b\d{4}-\d{2}-\d{2}")
+
+_section: ContextVar[str] = ContextVar("cassette_section", default="other")
+
+
+def _this_monday() -> datetime.date:
+    today = get_date()
+    return today - datetime.timedelta(days=today.weekday())
+
+
+def _relative_dates(text: str, monday: datetime.date) -> str:
+    """Replace dates with days since ``monday``: ``2025-03-03`` -> ``-7d`` on the week of 2025-03-10"""
+    def replace(match: re.Match) -> str:
+        try:
+            return f"{(datetime.date.fromisoformat(match[0]) - monday).days:+d}d"
+        except ValueError:
+            return match[0]
+
+    return _DATE.sub(replace, text)
+
+
+def _shift_dates(text: str, days: int) -> str:
+    """Move all dates in the text ``days`` days forward"""
+    def replace(match: re.Match) -> str:
+        try:
+            return (datetime.date.fromisoformat(match[0]) + datetime.timedelta(days=days)).isoformat()
+        except ValueError:
+            return match[0]
+
+    return _DATE.sub(replace, text) if days else text
+
+
+class CassetteMissError(LookupError):
+    """The request wasn't recorded, it can't be replayed"""
+
+
+@contextlib.contextmanager
+def cassette_section(name: str):
+    """Requests within the block are recorded to (and replayed from) the cassette ``name``"""
+    token = _section.set(name)
+    try:
+        yield
+    finally:
+        _section.reset(token)
+
+
+def scrub(value: typing.Any, key: typing.Optional[str] = None) -> typing.Any:
+    """Replace personal data and secrets in a response with placeholders of the same type"""
+    if isinstance(value, dict):
+        return {k: scrub(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [scrub(item, key) for item in value]
+    if key not in SCRUBBED_FIELDS or value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return 0
+    if isinstance(value, str):
+        return "2000-01-01" if _DATE.match(value) else "*"
+    return None
+
+
+class Cassettes:
+    """
+    Recorded upstream responses for benchmarks without network.
+
+    With ``mode="record"`` responses of octodiary APIs are written to ``<directory>/<section>.json``
+    (a file per ``DataType``, see ``cassette_section``), with ``mode="replay"`` they are served
+    from there after ``latency`` seconds instead of sending requests.
+    Requests are matched by method, URL and params, values of user ids are scrubbed, so cassettes
+    recorded with one account are replayed for any user. Dates in requests are matched relative to
+    the current week and dates in replayed responses are moved by whole weeks passed since recording,
+    so cassettes are replayed the same way on any later date.
+    """
+
+    def __init__(self, mode: str = "", directory: str = "files/cassettes", latency: float = 0) -> None:
+        self.mode = mode if mode in (RECORD, REPLAY) else ""
+        self.directory = directory
+        self.latency = latency
+        self.hits = self.misses = 0
+        self._stores: dict[str, BufferedLightDB] = {}
+
+        if self.mode:
+            logger.info(f"[Cassettes] {self.mode.capitalize()}ing upstream responses in {directory}")
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == RECORD
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    def _store(self, section: str) -> BufferedLightDB:
+        if (store := self._stores.get(section)) is None:
+            os.makedirs(self.directory, exist_ok=True)
+            store = self._stores[section] = BufferedLightDB(os.path.join(self.directory, f"{section}.json"))
+        return store
+
+    @staticmethod
+    def key(method: str, url: str, params: dict[str, typing.Any]) -> str:
+        params = {
+            name: "*" if name in SCRUBBED_PARAMS else value
+            for name, value in sorted(params.items())
+            if value is not None
+        }
+        key = f"{method.upper()} {_GUID.sub('*', url)}?" + "&".join(f"{name}={value}" for name, value in params.items())
+        return _relative_dates(key, _this_monday())
+
+    def record(self, method: str, url: str, params: dict[str, typing.Any], text: str) -> None:
+        try:
+            text = json.dumps(scrub(json.loads(text)), ensure_ascii=False)
+        except ValueError:
+            pass
+        self._store(_section.get()).set(
+            self.key(method, url, params),
+            {"week": _this_monday().isoformat(), "response": text}
+        )
+
+    async def replay(self, method: str, url: str, params: dict[str, typing.Any]) -> str:
+        key = self.key(method, url, params)
+        if (entry := self._store(_section.get()).get(key)) is None:
+            self.misses += 1
+            raise CassetteMissError(f"{key} isn't recorded in {_section.get()}")
+
+        self.hits += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return _shift_dates(entry["response"], (_this_monday() - datetime.date.fromisoformat(entry["week"])).days)
+
+
+cassettes = Cassettes(
+    mode=os.environ.get("CASSETTE_MODE", ""),
+    directory=os.environ.get("CASSETTE_DIR", "files/cassettes"),
+    latency=float(os.environ.get("CASSETTE_LATENCY", 0)),
+)
@@ -4,11 +4,17 @@
 #           https://github.com/OctoDiary
 
 import asyncio
+import os
+import time
 
 from aiogram import Router
 
+from core.misc.apis import APIs, pool
 from core.misc.loop import loop
+from core.misc.utils import run_sync
+from core.services.api import UserData
 from core.services.database import database
+from core.services.tokens import TOKEN_REFRESH_RETRY, refresh_scheduler, token_claims
 
 router = Router(name="Loops")
 
@@ -23,3 +29,63 @@ async def redis_queue_poller():
             pass
 
         database.redis._queue.remove(func) # noqa
+
+
+@router.startup()
+@loop(60)
+async def storage_compaction():
+    if getattr(database.storage, "needs_compaction", False):
+        await run_sync(database.storage.compact)
+
+
+@router.startup()
+async def storage_invalidations():
+    if not hasattr(database.storage, "invalidations"):
+        return
+
+    async def listen():
+        async for user_id in database.storage.invalidations(database.redis):
+            database.reload(user_id)
+
+    asyncio.ensure_future(listen())
+
+
+@router.startup()
+@loop(300)
+async def evict_api_clients():
+    APIs.evict(idle=float(os.environ.get("API_CLIENT_IDLE", 600)))
+
+
+async def refresh_user_token(user_id: str):
+    user = database.user(user_id)
+    if not (token := user.token) or not refresh_scheduler.is_current(user_id, token):
+        # the token was replaced after the refresh was scheduled, the new one has its own
+        return
+
+    try:
+        new_token = await UserData.refresh_token(token)
+    except Exception:
+        new_token = None
+
+    if new_token and new_token != "<TOKEN>":
+        user.token = new_token
+    elif token_claims(token)["exp"] > time.time():
+        refresh_scheduler.schedule(user_id, token, at=time.time() + TOKEN_REFRESH_RETRY)
+
+
+@router.startup()
+async def token_refresher():
+    for user_id in database.select_users(authorized=True):
+        refresh_scheduler.schedule(user_id, database.user(user_id).token)
+
+    asyncio.ensure_future(refresh_scheduler.run(refresh_user_token))
+
+
+@router.shutdown()
+async def close_database():
+    database.close()
+
+
+@router.shutdown()
+async def close_api_pool():
+    await pool.close()
@@ -0,0 +1,366 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import asyncio
+import collections
+import os
+import random
+import time
+import typing
+
+import aiohttp
+from loguru import logger
+from octodiary.exceptions import APIError
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Initial concurrency limits of systems, ``UPSTREAM_CONCURRENCY`` env: ``mes=16,myschool=8``
+UPSTREAM_CONCURRENCY = {
+    system.strip(): int(limit)
+    for item in filter(None, os.environ.get("UPSTREAM_CONCURRENCY", "").split(","))
+    for system, limit in [item.split("=")]
+}
+
+
+class RetryPolicy(typing.NamedTuple):
+    """
+    Retries of failed idempotent requests: up to ``attempts`` attempts in total with decorrelated jitter
+    (a random delay between ``base`` and 3 times the previous one, at most ``cap`` seconds).
+    With ``hedge`` a second request is sent if the first one takes longer than p95 latency of the upstream.
+    """
+
+    attempts: int = 1
+    base: float = 0.2
+    cap: float = 5
+    hedge: bool = False
+
+    def backoff(self, previous: float) -> float:
+        return min(self.cap, random.uniform(self.base, max(self.base, previous) * 3))
+
+
+class RetryBudget:
+    """
+    Retries and hedged requests of all upstreams are limited to ``ratio`` of requests:
+    every request adds ``ratio`` tokens (up to ``max_tokens``) and every retry takes one,
+    so failing upstreams aren't flooded with retries.
+    """
+
+    def __init__(self, ratio: float = 0.1, max_tokens: float = 10) -> None:
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.exhausted = 0
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        return True
+
+
+retry_budget = RetryBudget(ratio=float(os.environ.get("RETRY_BUDGET", 0.1)))
+
+
+class LatencyWindow:
+    """Latencies of the last ``size`` successful requests, the percentile is recomputed every ``every`` of them"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20, every: int = 10) -> None:
+        self.min_samples = min_samples
+        self.every = every
+        self._latencies: collections.deque[float] = collections.deque(maxlen=size)
+        self._added = 0
+        self._p95: typing.Optional[float] = None
+
+    def add(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self._added += 1
+        if self._added % self.every == 0 and len(self._latencies) >= self.min_samples:
+            latencies = sorted(self._latencies)
+            self._p95 = latencies[int(len(latencies) * 0.95) - 1]
+
+    @property
+    def p95(self) -> typing.Optional[float]:
+        return self._p95
+
+
+class CircuitOpenError(RuntimeError):
+    """Upstream is unhealthy and requests to it are rejected without being sent"""
+
+
+def is_failure(error: BaseException) -> bool:
+    """Whether the error means the upstream is unhealthy (and not e.g. a wrong request)"""
+    if isinstance(error, APIError):
+        return error.status_code >= 500 or error.status_code == 429
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of an upstream.
+
+    Opens when at least ``min_requests`` requests were finished within ``window`` seconds and
+    ``error_rate`` of them failed or ``slow_rate`` of them took longer than ``slow_call`` seconds.
+    Requests are rejected while it is open, after ``open_for`` seconds it is half-open:
+    up to ``probes`` requests are let through and it closes if all of them succeed, otherwise opens again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: float = 30,
+        min_requests: int = 10,
+        error_rate: float = 0.5,
+        slow_call: float = 5,
+        slow_rate: float = 0.5,
+        open_for: float = 30,
+        probes: int = 1,
+    ) -> None:
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_for = open_for
+        self.probes = probes
+
+        self.rejected = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = 0
+        self._probed = 0
+        # (finished at, failed, slow)
+        self._calls: collections.deque[tuple[float, bool, bool]] = collections.deque()
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_for:
+            self._set_state(HALF_OPEN)
+        return self._state
+
+    def _set_state(self, state: str) -> None:
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state in (CLOSED, HALF_OPEN):
+            self._probing = self._probed = 0
+        if state == CLOSED:
+            self._calls.clear()
+
+        if state != self._state:
+            logger.log(
+                "WARNING" if state == OPEN else "INFO",
+                f"[CircuitBreaker] {self.name}: {self._state} -> {state}"
+            )
+        self._state = state
+
+    def acquire(self) -> bool:
+        """Let a request through. Returns whether it is a probe, raises ``CircuitOpenError`` if it is rejected."""
+        state = self.state
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and self._probing < self.probes:
+            self._probing += 1
+            return True
+
+        self.rejected += 1
+        raise CircuitOpenError(f"{self.name} is unavailable, retry in {self.retry_in:.0f}s")
+
+    def record(self, failed: typing.Optional[bool], latency: float, probe: bool = False) -> None:
+        """Result of a request let through by ``acquire``, ``failed=None`` if it was cancelled"""
+        slow = latency >= self.slow_call
+        if probe:
+            self._probing -= 1
+            if failed is None or self._state != HALF_OPEN:
+                return
+            if failed or slow:
+                self._set_state(OPEN)
+            elif (probed := self._probed + 1) >= self.probes:
+                self._set_state(CLOSED)
+            else:
+                self._probed = probed
+            return
+
+        if failed is None or self._state != CLOSED:
+            return
+
+        now = time.monotonic()
+        self._calls.append((now, failed, slow))
+        while self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+        stats = self.stats()
+        if stats["requests"] >= self.min_requests and (
+            stats["errors"] >= self.error_rate or stats["slow"] >= self.slow_rate
+        ):
+            self._set_state(OPEN)
+
+    @property
+    def retry_in(self) -> float:
+        return max(0.0, self._opened_at + self.open_for - time.monotonic()) if self._state == OPEN else 0.0
+
+    def stats(self) -> dict[str, typing.Any]:
+        """Requests finished within the window and shares of failed and slow ones"""
+        requests = len(self._calls)
+        return {
+            "requests": requests,
+            "errors": sum(failed for _, failed, _ in self._calls) / requests if requests else 0.0,
+            "slow": sum(slow for _, _, slow in self._calls) / requests if requests else 0.0,
+        }
+
+
+class AIMDLimiter:
+    """
+    Adaptive concurrency limit of an upstream (additive increase, multiplicative decrease).
+
+    The limit grows by ``1 / limit`` with every successful request sent while it was reached (about one
+    per ``limit`` requests) and is multiplied by ``decrease`` when a request fails or takes longer than
+    ``slow_call`` seconds, at most once per ``cooldown`` seconds, so a burst of concurrent failures cuts it once.
+    """
+
+    def __init__(
+        self,
+        limit: int = 16,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        decrease: float = 0.5,
+        slow_call: float = 5,
+        cooldown: float = 1,
+    ) -> None:
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, limit)
+        self.decrease = decrease
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self.waiting = 0
+        self._decreased_at = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            self.waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+
+    async def release(self, failed: typing.Optional[bool], latency: float) -> None:
+        saturated = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        if failed or (failed is not None and latency >= self.slow_call):
+            if time.monotonic() - self._decreased_at >= self.cooldown:
+                self.limit = max(float(self.min_limit), self.limit * self.decrease)
+                self._decreased_at = time.monotonic()
+        elif failed is not None and saturated:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+        async with self._condition:
+            self._condition.notify_all()
+
+
+class Upstream:
+    """Circuit breaker, concurrency limit and retries of requests to a system (``mes``, ``myschool``)"""
+
+    registry: dict[str, "Upstream"] = {}
+
+    def __init__(self, name: str, breaker: CircuitBreaker, limiter: AIMDLimiter) -> None:
+        self.name = name
+        self.breaker = breaker
+        self.limiter = limiter
+        self.latencies = LatencyWindow()
+        self.retries = 0
+        self.hedged = 0
+
+    @classmethod
+    def get(cls, system: str) -> "Upstream":
+        name = system.lower().replace("_", "")
+        if (upstream := cls.registry.get(name)) is None:
+            slow_call = float(os.environ.get("BREAKER_SLOW_CALL", 5))
+            upstream = cls.registry[name] = cls(
+                name,
+                CircuitBreaker(
+                    name,
+                    error_rate=float(os.environ.get("BREAKER_ERROR_RATE", 0.5)),
+                    slow_call=slow_call,
+                    open_for=float(os.environ.get("BREAKER_OPEN_FOR", 30)),
+                ),
+                AIMDLimiter(
+                    limit=UPSTREAM_CONCURRENCY.get(name, 16),
+                    max_limit=int(os.environ.get("UPSTREAM_CONCURRENCY_MAX", 64)),
+                    slow_call=slow_call,
+                ),
+            )
+        return upstream
+
+    async def call(self, func: typing.Callable[..., typing.Awaitable], *args, **kwargs):
+        """Send the request through the breaker and the limiter"""
+        probe = self.breaker.acquire()
+        try:
+            await self.limiter.acquire()
+        except BaseException:
+            self.breaker.record(None, 0, probe)
+            raise
+
+        failed, started = None, time.monotonic()
+        try:
+            result = await func(*args, **kwargs)
+            failed = False
+            return result
+        except Exception as e:
+            failed = is_failure(e)
+            raise
+        finally:
+            latency = time.monotonic() - started
+            if failed is False:
+                self.latencies.add(latency)
+            self.breaker.record(failed, latency, probe)
+            await self.limiter.release(failed, latency)
+
+    async def request(self, func: typing.Callable[[], typing.Awaitable], policy: RetryPolicy = RetryPolicy()):
+        """
+        ``call`` with retries of failures of the upstream (see ``is_failure``) and hedging by the ``policy``,
+        within the global ``retry_budget``. Rejections of the open breaker aren't retried.
+        """
+        retry_budget.deposit()
+        delay = 0.0
+        for attempt in range(1, policy.attempts + 1):
+            try:
+                return await (self._hedged(func) if policy.hedge else self.call(func))
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                if attempt >= policy.attempts or not is_failure(e) or not retry_budget.withdraw():
+                    raise
+                delay = policy.backoff(delay)
+                self.retries += 1
+                logger.debug(f"[Upstream] {self.name}: attempt {attempt} failed ({e!r}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _hedged(self, func: typing.Callable[[], typing.Awaitable]):
+        """Send a second request if the first one isn't finished within p95 latency, the first result wins"""
+        pending = {asyncio.ensure_future(self.call(func))}
+        try:
+            delay = self.latencies.p95
+            if delay is not None and self.limiter.in_flight < int(self.limiter.limit):
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done and retry_budget.withdraw():
+                    self.hedged += 1
+                    pending.add(asyncio.ensure_future(self.call(func)))
+
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded or not pending:
+                    return (succeeded or list(done))[0].result()
+        finally:
+            for task in pending:
+                task.cancel()
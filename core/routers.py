@@ -14,6 +14,7 @@ from core.handlers.admins import router as admins_router
 from core.misc.loops import router as loops_router
 
 from core.handlers import exceptions
+from core.middlewares import batch, renders
 
 routers = [
     start_router,
@@ -3,26 +3,36 @@
 #        https://opensource.org/licenses/MIT
 #           https://github.com/OctoDiary
 
+import asyncio
 import datetime
-import enum
-import pickle
+import functools
+import json
+import os
+import time
 import typing
 from datetime import timedelta
 
-import jwt
 from aiogram import Bot
 from loguru import logger
-from octodiary.types.mobile import FamilyProfile, EventsResponse, SubjectsMarks, ShortHomeworks, Marks, \
+from octodiary.types.mobile import FamilyProfile, EventsResponse, SubjectsMarks, Marks, \
     LessonScheduleItem
+from octodiary.types.mobile.marks import Payload as MarksPayload
 from octodiary.urls import BaseURL, URLTypes
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
 from core.misc.additional_models import MarkInfo, Homeworks
-from core.misc.apis import APIs
+from core.misc.apis import APIs, raw_responses
+from core.misc.cassettes import cassette_section
+from core.misc.lru import LRUCache
+from core.misc.upstream import RetryPolicy, Upstream
 from core.misc.texts import Texts
 from core.misc.utils import get_date, TIMEZONE, get_week_for_date, get_datetime, send_message
+from core.services import cache_keys
+from core.services.cache_keys import DataType
+from core.services.codecs import codec
 from core.services.database import User, database
 from core.services.octodiary_x import refresh_token
+from core.services.tokens import TOKEN_REFRESH_BEFORE, token_claims
 
 ResponseType = typing.TypeVar("ResponseType")
 
@@ -33,16 +43,106 @@ class APIResponse(BaseModel, typing.Generic[ResponseType]):
     last_cache_time: typing.Optional[str] = None
 
 
-class DataType(enum.Enum):
-    MATERIAL_LAUNCH_LINK = "material_launch_link"
-    PROFILE_ID = "profile_id"
-    PROFILE = "profile"
-    EVENTS = "events"
-    HOMEWORKS = "homeworks"
-    MARKS_BY_DATE = "marks_by_date"
-    MARKS_BY_SUBJECT = "marks_by_subject"
-    SCHEDULE_ITEM = "schedule_item"
-    MARK = "mark"
+class RequestContext(typing.NamedTuple):
+    """Ids of the user and the current child used by requests of ``UserData``"""
+    student_id: typing.Optional[int]
+    person_id: typing.Optional[str]
+    mes_role: typing.Optional[str]
+    profile_id: typing.Optional[int]
+    system: str
+
+
+def _cache_ttls() -> dict[DataType, int]:
+    """TTLs (seconds) of cached data types, overridden by ``CACHE_TTL`` env: ``profile=2592000,events=604800``"""
+    ttls = {
+        DataType.PROFILE: 30 * 24 * 3600,
+        DataType.MARKS_BY_SUBJECT: 14 * 24 * 3600,
+        DataType.EVENTS: 14 * 24 * 3600,
+        DataType.HOMEWORKS: 14 * 24 * 3600,
+        DataType.MARKS_BY_DATE: 14 * 24 * 3600,
+    }
+    for item in filter(None, os.environ.get("CACHE_TTL", "").split(",")):
+        name, ttl = item.split("=")
+        ttls[DataType(name.strip())] = int(ttl)
+    return ttls
+
+
+CACHE_TTL = _cache_ttls()
+
+
+def _retry_policies() -> dict[DataType, RetryPolicy]:
+    """
+    Retries of idempotent requests, overridden by ``UPSTREAM_RETRIES`` env (attempts): ``events=3,mark=2``.
+    Types from ``UPSTREAM_HEDGE`` env (``events,marks_by_date``) are hedged after p95 latency of the system.
+    """
+    attempts = {
+        DataType.EVENTS: 3,
+        DataType.MARKS_BY_DATE: 3,
+        DataType.MARKS_BY_SUBJECT: 3,
+        DataType.HOMEWORKS: 3,
+        DataType.SCHEDULE_ITEM: 3,
+    }
+    for item in filter(None, os.environ.get("UPSTREAM_RETRIES", "").split(",")):
+        name, count = item.split("=")
+        attempts[DataType(name.strip())] = int(count)
+    hedged = {DataType(name.strip()) for name in os.environ.get("UPSTREAM_HEDGE", "").split(",") if name.strip()}
+
+    base, cap = float(os.environ.get("RETRY_BASE", 0.2)), float(os.environ.get("RETRY_CAP", 5))
+    return {
+        name: RetryPolicy(attempts=attempts.get(name, 1), base=base, cap=cap, hedge=name in hedged)
+        for name in DataType
+    }
+
+
+RETRY_POLICIES = _retry_policies()
+
+# Systems for which ``load_all`` loads events and marks of all weeks with one request, ``WIDE_RANGE_FETCH`` env: ``mes,myschool``
+WIDE_RANGE_FETCH = {system.strip() for system in os.environ.get("WIDE_RANGE_FETCH", "").split(",") if system.strip()}
+
+# ``UserData.sync_marks``: days requested on an incremental sync and seconds between full syncs
+MARKS_SYNC_DAYS = int(os.environ.get("MARKS_SYNC_DAYS", 7))
+MARKS_FULL_SYNC = float(os.environ.get("MARKS_FULL_SYNC", 6 * 3600))
+
+
+def _parse_updated_at(value: typing.Optional[str]) -> typing.Optional[datetime.datetime]:
+    if not value:
+        return None
+    try:
+        updated_at = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return updated_at if updated_at.tzinfo else updated_at.replace(tzinfo=TIMEZONE)
+
+
+def project(data: typing.Any, exclude: typing.Any) -> typing.Any:
+    """Drop ``exclude`` fields (``model_dump`` syntax: nested dicts/sets, ``__all__`` for items of lists) from raw JSON"""
+    if not exclude or data is None:
+        return data
+    if isinstance(exclude, (set, frozenset)):
+        exclude = dict.fromkeys(exclude, True)
+
+    if isinstance(data, list):
+        items = exclude.get("__all__")
+        return data if items is None else [project(item, items) for item in data]
+    if isinstance(data, dict):
+        return {
+            key: value if (sub := exclude.get(key)) is None else project(value, sub)
+            for key, value in data.items()
+            if exclude.get(key) is not True
+        }
+    return data
+
+
+def _is_week(key: str) -> bool:
+    try:
+        datetime.date.fromisoformat(key)
+    except ValueError:
+        return False
+    return True
+
+
+# Seconds while results of ``UserData.get`` are reused by identical requests
+UPSTREAM_FRESHNESS = float(os.environ.get("UPSTREAM_FRESHNESS", 0))
 
 
 class UserData:
@@ -53,11 +153,27 @@ class UserData:
     MODELS = {
         DataType.PROFILE: FamilyProfile,
         DataType.EVENTS: EventsResponse,
-        DataType.HOMEWORKS: ShortHomeworks,
+        DataType.HOMEWORKS: Homeworks,
         DataType.MARKS_BY_DATE: Marks,
         DataType.MARKS_BY_SUBJECT: SubjectsMarks,
         DataType.SCHEDULE_ITEM: LessonScheduleItem
     }
+    # cached as raw responses by weeks, a key per week (``user:<id>:<type>:<week>``)
+    WEEKLY = (DataType.EVENTS, DataType.HOMEWORKS, DataType.MARKS_BY_DATE)
+    # data which can be loaded for several weeks at once: list field of items and date field of an item
+    WIDE_RANGE = {DataType.EVENTS: ("response", "start_at"), DataType.MARKS_BY_DATE: ("payload", "date")}
+    # model_dump arguments of weeks
+    WEEK_DUMP = {DataType.EVENTS: {"exclude": {"response": {"__all__": {"class_unit_ids"}}}}}
+
+    # validated models of cached data: (user id, DataType, week) -> (model, loaded at, stamp).
+    # A model is used while its data in Redis has the same stamp (the time it was cached at, see ``_stamp``),
+    # so data cached by other processes, purged or expired is read again
+    decoded = LRUCache(int(os.environ.get("DECODED_CACHE_SIZE", 4096)))
+
+    # single-flight of ``get``: in-flight requests and recent results by (user id, DataType, profile id, params)
+    _in_flight: dict[tuple, asyncio.Future] = {}
+    _recent = LRUCache(1024)
+    single_flight = {"requests": 0, "coalesced": 0, "fresh": 0}
 
     def __init__(self, user: User, apis: APIs):
         self.db_user = user
@@ -65,109 +181,116 @@ class UserData:
         self.data = {}
 
         self.profile_id: typing.Optional[int] = None
+        self._context: typing.Optional[RequestContext] = None
 
     @classmethod
     async def refresh_token(cls, token: str) -> str:
-        data = jwt.decode(token, options={"verify_signature": False})
+        data = token_claims(token)
         return await refresh_token(token, data, region=50 if "mosreg.ru" in data["iss"] else 77)
 
-    async def get(self, name: DataType, **kwargs):
+    async def get(self, name: DataType, fresh: typing.Optional[float] = None, **kwargs):
         """
+        Request the data from upstream. Concurrent identical requests share one in-flight request,
+        results younger than ``fresh`` seconds (``UPSTREAM_FRESHNESS`` env by default) are reused.
+        Requests go through the ``Upstream`` of the system: while its breaker is open
+        ``CircuitOpenError`` is raised right away, so callers fall back to the cache.
+        Failures of idempotent types are retried and slow requests may be hedged (see ``RETRY_POLICIES``).
+
         :param name:
-        :param kwargs: begin_date/from_date, end_date, student_id, subject,
+        :param fresh: Freshness window, seconds.
+        :param kwargs: begin_date/from_date, end_date, student_id, subject, raw (the response JSON without parsing),
         :return:
         """
+        key = self._request_key(name, kwargs)
+        fresh = UPSTREAM_FRESHNESS if fresh is None else fresh
+        UserData.single_flight["requests"] += 1
+
+        if fresh and (recent := UserData._recent.get(key)) is not None and time.monotonic() - recent[0] < fresh:
+            UserData.single_flight["fresh"] += 1
+            return recent[1]
+
+        if (task := UserData._in_flight.get(key)) is not None:
+            UserData.single_flight["coalesced"] += 1
+        else:
+            task = UserData._in_flight[key] = asyncio.ensure_future(
+                Upstream.get(self.db_user.system).request(
+                    functools.partial(self._get, name, **kwargs), RETRY_POLICIES[name]
+                )
+            )
+            task.add_done_callback(lambda _: UserData._in_flight.pop(key, None))
+
+        # shielded, so a cancelled caller doesn't cancel the request of the others
+        result = await asyncio.shield(task)
+        if fresh:
+            UserData._recent.set(key, (time.monotonic(), result))
+        return result
+
+    def _request_key(self, name: DataType, kwargs: dict[str, typing.Any]) -> tuple:
+        """Identity of the request: the same for every ``UserData`` of the user asking for the same child's data"""
+        context = self.context
+        student_id = kwargs.get("student_id") or context.student_id
+        params = tuple(sorted((k, repr(v)) for k, v in kwargs.items() if v is not None and k != "student_id"))
+        return self.db_user.id, name, student_id, self.profile_id or context.profile_id, params
+
+    async def _get(self, name: DataType, raw: bool = False, **kwargs):
+        """Request the data. With ``raw`` the response JSON is returned as is, without parsing it into the model."""
+        with cassette_section(name.value):
+            if not raw:
+                return await self._request(name, **kwargs)
+
+            with raw_responses():
+                response = await self._request(name, **kwargs)
+        return json.loads(response) if response else None
+
+    async def _request(self, name: DataType, **kwargs):
         today = get_date()
+        context = self.context
+        student_id = kwargs.get("student_id", None) or context.student_id
         match name:
             case DataType.PROFILE_ID:
                 return (await self.apis.mobile.get_users_profile_info())[0].id
             case DataType.PROFILE:
-                return await self.apis.mobile.get_family_profile(profile_id=self.profile_id)
+                return await self.apis.mobile.get_family_profile(profile_id=self.profile_id or context.profile_id)
             case DataType.EVENTS:
                 return await self.apis.mobile.get_events(
-                    person_id=(
-                        self.db_user.db_current_child["contingent_guid"]
-                        if self.db_user.db_current_child
-                        else (
-                            self.data[DataType.PROFILE].children[0].id
-                            if DataType.PROFILE in self.data
-                            else self.db_user.db_profile["children"][0]["contingent_guid"]
-                        )
-                    ),
-                    mes_role=(
-                        self.data[DataType.PROFILE].profile.type
-                        if DataType.PROFILE in self.data
-                        else self.db_user.db_profile["profile"]["type"]
-                    ),
+                    person_id=context.person_id,
+                    mes_role=context.mes_role,
                     begin_date=kwargs.get("begin_date", None) or (today - timedelta(days=-1 * (0 - today.weekday()))),
                     end_date=kwargs.get("end_date", None) or (today + timedelta(days=7 + (6 - today.weekday()))),
                 )
             case DataType.MARKS_BY_DATE:
                 return await self.apis.mobile.get_marks(
-                    student_id=(
-                        kwargs.get("student_id", None)
-                        or (
-                            self.db_user.db_current_child["id"]
-                            if self.db_user.db_current_child
-                            else (
-                                self.data[DataType.PROFILE].children[0].id
-                                if DataType.PROFILE in self.data
-                                else self.db_user.db_profile["children"][0]["id"]
-                            )
-                        )
-                    ),
-                    profile_id=self.db_user.db_profile_id,
+                    student_id=student_id,
+                    profile_id=context.profile_id,
                     from_date=kwargs["from_date"],
                     to_date=kwargs["to_date"]
                 )
             case DataType.MARKS_BY_SUBJECT:
                 return await self.apis.mobile.get_subjects_marks(
-                    student_id=(
-                        kwargs.get("student_id", None)
-                        or (
-                            self.db_user.db_current_child["id"]
-                            if self.db_user.db_current_child
-                            else (
-                                self.data[DataType.PROFILE].children[0].id
-                                if DataType.PROFILE in self.data
-                                else self.db_user.db_profile["children"][0]["id"]
-                            )
-                        )
-                    ),
-                    profile_id=self.db_user.db_profile_id
+                    student_id=student_id,
+                    profile_id=context.profile_id
                 )
             case DataType.HOMEWORKS:
                 return await self.apis.mobile.request(
                     method="GET",
-                    base_url=BaseURL(type=URLTypes.SCHOOL_API, system=self.db_user.system),
+                    base_url=BaseURL(type=URLTypes.SCHOOL_API, system=context.system),
                     path="/family/mobile/v1/homeworks",
                     params={
-                        "student_id": (
-                            kwargs.get("student_id", None)
-                            or (
-                                self.db_user.db_current_child["id"]
-                                if self.db_user.db_current_child
-                                else (
-                                    self.data[DataType.PROFILE].children[0].id
-                                    if DataType.PROFILE in self.data
-                                    else self.db_user.db_profile["children"][0]["id"]
-                                )
-                            )
-                        ),
+                        "student_id": student_id,
                         "from": kwargs.get("from_date"),
                         "to": kwargs.get("to_date"),
                     },
                     custom_headers={
                         "x-mes-subsystem": "familymp",
                         "client-type": "diary-mobile",
-                        "profile-id": self.db_user.db_profile_id,
+                        "profile-id": context.profile_id,
                     },
                     model=Homeworks,
                 )
             case DataType.MATERIAL_LAUNCH_LINK:
                 return await self.apis.mobile.request(
                     method="GET",
-                    base_url=BaseURL(type=URLTypes.DNEVNIK if self.db_user.system == "mes" else URLTypes.SCHOOL, system=self.db_user.system),
+                    base_url=BaseURL(type=URLTypes.DNEVNIK if context.system == "mes" else URLTypes.SCHOOL, system=context.system),
                     path="/ej/family/homework/launch",
                     params={
                         "homework_entry_id": kwargs.get("homework_entry_id"),
@@ -180,58 +303,232 @@ class UserData:
                 )
             case DataType.SCHEDULE_ITEM:
                 return await self.apis.mobile.get_lesson_schedule_item(
-                    profile_id=self.db_user.db_profile_id,
-                    student_id=(
-                        kwargs.get("student_id", None)
-                        or (
-                            self.db_user.db_current_child["id"]
-                            if self.db_user.db_current_child
-                            else (
-                                self.data[DataType.PROFILE].children[0].id
-                                if DataType.PROFILE in self.data
-                                else self.db_user.db_profile["children"][0]["id"]
-                            )
-                        )
-                    ),
+                    profile_id=context.profile_id,
+                    student_id=student_id,
                     lesson_id=kwargs.get("lesson_id"), type=kwargs.get("lesson_type")
                 )
             case DataType.MARK:
                 return await self.apis.mobile.request(
                     method="GET",
-                    base_url=BaseURL(type=URLTypes.SCHOOL_API, system=self.db_user.system),
+                    base_url=BaseURL(type=URLTypes.SCHOOL_API, system=context.system),
                     path=f"/family/mobile/v1/marks/{kwargs['mark_id']}",
                     params={
-                        "student_id": (
-                            kwargs.get("student_id", None)
-                            or (
-                                self.db_user.db_current_child["id"]
-                                if self.db_user.db_current_child
-                                else (
-                                    self.data[DataType.PROFILE].children[0].id
-                                    if DataType.PROFILE in self.data
-                                    else self.db_user.db_profile["children"][0]["id"]
-                                )
-                            )
-                        ),
+                        "student_id": student_id,
                     },
                     custom_headers={
                         "x-mes-subsystem": "familymp",
                         "client-type": "diary-mobile",
-                        "profile-id": self.db_user.db_profile_id,
+                        "profile-id": context.profile_id,
                     },
                     model=MarkInfo
                 )
 
-    async def get_cached(self, name: DataType, key: str = None, raw: bool = False):
-        raw_data = await database.redis.get(key or f"user:{self.db_user.id}:{name}")
-        if not raw_data:
-            return None
+    @property
+    def context(self) -> RequestContext:
+        """Ids for requests, resolved on the first use (see ``resolve_context``)"""
+        return self._context or self.resolve_context()
 
+    def resolve_context(self) -> RequestContext:
+        """
+        Resolve ids of the current child from the user once: the selected child,
+        otherwise the first child of the loaded (or saved) profile.
+        Call it again after the profile is loaded or the child is switched.
+        """
+        user = self.db_user
+        child, profile, profile_id, system = user.db_current_child, user.db_profile or {}, user.db_profile_id, user.system
+
+        if child:
+            student_id, person_id = child["id"], child.get("contingent_guid")
+        elif DataType.PROFILE in self.data:
+            first = self.data[DataType.PROFILE].children[0]
+            student_id, person_id = first.id, first.contingent_guid
+        else:
+            first = (profile.get("children") or [{}])[0]
+            student_id, person_id = first.get("id"), first.get("contingent_guid")
+
+        self._context = RequestContext(
+            student_id=student_id,
+            person_id=person_id,
+            mes_role=(
+                self.data[DataType.PROFILE].profile.type
+                if DataType.PROFILE in self.data
+                else (profile.get("profile") or {}).get("type")
+            ),
+            profile_id=profile_id,
+            system=system,
+        )
+        return self._context
+
+    def _cache_key(self, name: DataType) -> str:
+        return cache_keys.data_key(self.db_user.id, name)
+
+    def _week_key(self, name: DataType, week: str) -> str:
+        return cache_keys.week_key(self.db_user.id, name, week)
+
+    def _weeks_key(self, name: DataType) -> str:
+        return cache_keys.weeks_key(self.db_user.id, name)
+
+    def _meta_key(self, name: DataType) -> str:
+        return cache_keys.meta_key(self.db_user.id, name)
+
+    def _loaded_key(self) -> str:
+        return cache_keys.loaded_key(self.db_user.id)
+
+    async def _stamp(self, name: DataType, week: typing.Optional[str] = None) -> typing.Optional[str]:
+        """Time the data (the week of week-keyed data) was cached at, ``None`` if it isn't cached"""
+        async with database.redis.pipeline(transaction=False) as pipeline:
+            if week is None:
+                pipeline.hget(self._loaded_key(), name.value)
+                pipeline.exists(self._cache_key(name))
+            else:
+                pipeline.hget(self._weeks_key(name), week)
+                pipeline.exists(self._week_key(name, week))
+            stamp, exists = await pipeline.execute()
+        return stamp.decode() if stamp and exists else None
+
+    @staticmethod
+    def _from_cache(name: DataType, raw_data: bytes, raw: bool):
         return UserData.MODELS[name].model_validate(
-            pickle.loads(
+            codec.decode(
                 raw_data
             )
-        ) if not raw else pickle.loads(raw_data)
+        ) if not raw else codec.decode(raw_data)
+
+    async def get_cached(
+        self,
+        name: DataType,
+        key: str = None,
+        raw: bool = False,
+        week: typing.Optional[datetime.date] = None
+    ):
+        """
+        Get cached data. With ``week`` (its first day) returns the model of this week of week-keyed data,
+        raw week-keyed data is returned as ``get_cached_weeks`` does.
+        Models are kept in the in-process ``decoded`` cache while the cached data stays the same.
+        """
+        if week is not None:
+            return (await self.get_cached_week(name, week))[0]
+
+        if name in UserData.WEEKLY and not key:
+            return await self.get_cached_weeks(name) or None
+
+        if raw or key:
+            raw_data = await database.redis.get(key or self._cache_key(name))
+            return self._from_cache(name, raw_data, raw) if raw_data else None
+
+        decoded_key = (self.db_user.id, name, None)
+        if (cached := UserData.decoded.get(decoded_key)) is not None and cached[2] == await self._stamp(name):
+            return cached[0]
+
+        async with database.redis.pipeline(transaction=True) as pipeline:
+            pipeline.get(self._cache_key(name))
+            pipeline.hget(self._loaded_key(), name.value)
+            raw_data, stamp = await pipeline.execute()
+        if not raw_data:
+            return None
+
+        model = self._from_cache(name, raw_data, raw=False)
+        if stamp:
+            UserData.decoded.set(decoded_key, (model, None, stamp.decode()))
+        return model
+
+    async def get_cached_week(
+        self,
+        name: DataType,
+        week: datetime.date
+    ) -> tuple[typing.Any, typing.Optional[datetime.datetime]]:
+        """Cached model of the week (its first day) of week-keyed data and the time it was loaded at"""
+        week = week.isoformat()
+        decoded_key = (self.db_user.id, name, week)
+        if (cached := UserData.decoded.get(decoded_key)) is not None and cached[2] == await self._stamp(name, week):
+            return cached[:2]
+
+        async with database.redis.pipeline(transaction=True) as pipeline:
+            pipeline.get(self._week_key(name, week))
+            pipeline.hget(self._weeks_key(name), week)
+            raw_data, loaded_at = await pipeline.execute()
+
+        if not raw_data:
+            return None, None
+
+        try:
+            # weeks are cached as raw upstream JSON, so they are validated only here
+            model = UserData.MODELS[name].model_validate(codec.decode(raw_data))
+        except ValidationError:
+            logger.warning(f"[UserData] Cached {name} of {self.db_user.id} for {week} is invalid")
+            return None, None
+
+        if not loaded_at:
+            return model, None
+
+        cached = (model, datetime.datetime.fromisoformat(loaded_at.decode()), loaded_at.decode())
+        UserData.decoded.set(decoded_key, cached)
+        return cached[:2]
+
+    async def get_cached_weeks(self, name: DataType) -> dict[str, typing.Any]:
+        """
+        All cached weeks of week-keyed data, raw: ``{week: data}``, ``updated`` with ``{week: loaded at}``
+        and fields of its metadata (e.g. ``watermark`` of marks). Expired weeks are dropped from the index.
+        """
+        async with database.redis.pipeline(transaction=False) as pipeline:
+            pipeline.hgetall(self._weeks_key(name))
+            pipeline.get(self._meta_key(name))
+            index, meta = await pipeline.execute()
+
+        if not index:
+            return codec.decode(meta) if meta else {}
+
+        weeks = sorted(week.decode() for week in index)
+        values = await database.redis.mget([self._week_key(name, week) for week in weeks])
+        if expired := [week for week, raw_data in zip(weeks, values) if raw_data is None]:
+            await database.redis.hdel(self._weeks_key(name), *expired)
+
+        return (codec.decode(meta) if meta else {}) | {
+            week: codec.decode(raw_data) for week, raw_data in zip(weeks, values) if raw_data is not None
+        } | {"updated": {
+            week: index[week.encode()].decode() for week, raw_data in zip(weeks, values) if raw_data is not None
+        }}
+
+    def _cache_weeks(self, pipeline, name: DataType, weeks: dict[str, typing.Any], loaded_at: str) -> None:
+        """Queue writes of weeks (``{week: dump}``) of week-keyed data: a key per week with its own TTL and the index"""
+        ttl = CACHE_TTL.get(name) or None
+        for week, value in weeks.items():
+            pipeline.set(self._week_key(name, week), codec.encode(value), ex=ttl)
+        if weeks:
+            pipeline.hset(self._weeks_key(name), mapping=dict.fromkeys(weeks, loaded_at))
+            if ttl:
+                pipeline.expire(self._weeks_key(name), ttl)
+        # the whole dict of weeks was a single key before
+        pipeline.delete(cache_keys.legacy_key(self.db_user.id, name))
+
+    @staticmethod
+    def dump_week(name: DataType, model: BaseModel) -> dict[str, typing.Any]:
+        """JSON of a week of the data as it is cached (without fields excluded by ``WEEK_DUMP``)"""
+        return model.model_dump(mode="json", **UserData.WEEK_DUMP.get(name, {}))
+
+    async def cache_week(self, name: DataType, week: datetime.date, model: BaseModel) -> None:
+        """Put the week (its first day) of week-keyed data, loaded by ``get``, to the cache"""
+        async with database.redis.pipeline(transaction=True) as pipeline:
+            self._cache_weeks(pipeline, name, {week.isoformat(): self.dump_week(name, model)}, get_datetime().isoformat())
+            await pipeline.execute()
+
+    async def get_cached_many(
+        self,
+        names: typing.Iterable[DataType],
+        raw: typing.Optional[bool] = None
+    ) -> dict[DataType, typing.Any]:
+        """
+        ``get_cached`` for several data types in one round trip.
+        By default, week-keyed data (``WEEKLY``) is returned raw (see ``get_cached_weeks``) and the rest as models.
+        """
+        names = list(names)
+        weekly = [name for name in names if name in UserData.WEEKLY]
+        names = [name for name in names if name not in UserData.WEEKLY]
+        values = await database.redis.mget([self._cache_key(name) for name in names]) if names else []
+        return {
+            name: self._from_cache(name, raw_data, bool(raw)) if raw_data else None
+            for name, raw_data in zip(names, values)
+        } | dict(zip(weekly, await asyncio.gather(*map(self.get_cached_weeks, weekly))))
 
     async def load(self, name: DataType, on_loaded=None, on_error=None, **kwargs):
         try:
@@ -268,6 +565,7 @@ class UserData:
                 exclude_none=True,
                 exclude_unset=True
             )
+            self.resolve_context()
         except Exception as e:
             raise e
             return False, e  # noqa
@@ -279,81 +577,193 @@ class UserData:
             if (week := get_week_for_date(date + timedelta(weeks=i)))
         ]
 
-        time = get_datetime()
-        events = {"datetime": time.isoformat()}
-        homeworks = {"datetime": time.isoformat()}
-        marks_by_date = {"datetime": time.isoformat()}
+        now = get_datetime()
+        wide = self.db_user.system.lower().replace("_", "") in WIDE_RANGE_FETCH
+        marks_by_date, events, homeworks = await asyncio.gather(
+            self.sync_marks(weeks, wide=wide),
+            self.load_weeks(DataType.EVENTS, weeks, None, wide=wide),
+            self.load_weeks(DataType.HOMEWORKS, weeks, None),
+        )
+        events, homeworks = (
+            {"datetime": now.isoformat()} | {week[0].isoformat(): value for week, value in zip(weeks, values)}
+            for values in (events, homeworks)
+        )
+        marks_by_date = {"datetime": now.isoformat()} | marks_by_date[0]
+
+        self.data[DataType.EVENTS] = events
+        self.data[DataType.HOMEWORKS] = homeworks
+        self.data[DataType.MARKS_BY_DATE] = marks_by_date
+
+        await self.load(DataType.MARKS_BY_SUBJECT, raw=True)
 
-        for week in weeks:
+        await self.cache_data()
+
+    @staticmethod
+    def range_kwargs(name: DataType, begin: datetime.date, end: datetime.date) -> dict[str, datetime.date]:
+        return {"begin_date": begin, "end_date": end} if name == DataType.EVENTS else {"from_date": begin, "to_date": end}
+
+    async def load_weeks(self, name: DataType, weeks: list[list[datetime.date]], default, wide: bool = False) -> list:
+        """
+        Load week-keyed data of the weeks as raw JSON (projected by ``WEEK_DUMP``), the way it is cached.
+        By default, each week is a separate request and a failed one gets the ``default`` value.
+        With ``wide`` (events and marks only) the whole range is a single request split into weeks locally.
+        """
+        exclude = UserData.WEEK_DUMP.get(name, {}).get("exclude")
+        if wide and name in UserData.WIDE_RANGE:
             try:
-                marks_by_date[week[0].isoformat()] = (await self.get(
-                    DataType.MARKS_BY_DATE,
-                    from_date=week[0],
-                    to_date=week[-1]
-                )).model_dump(
-                    mode="json"
-                )
+                response = await self.get(name, raw=True, **self.range_kwargs(name, weeks[0][0], weeks[-1][-1]))
             except Exception:
-                marks_by_date[week[0].isoformat()] = []
+                return [default] * len(weeks)
+            if response is None:
+                return [default] * len(weeks)
+
+            buckets = self.split_weeks(name, response, [week[0] for week in weeks])
+            return [project(buckets[week[0]], exclude) for week in weeks]
 
+        async def load_week(week: list[datetime.date]):
             try:
-                events[week[0].isoformat()] = (await self.get(
-                    DataType.EVENTS,
-                    begin_date=week[0],
-                    to_date=week[-1]
-                )).model_dump(
-                    mode="json",
-                    exclude={"response": {"__all__": {"class_unit_ids"}}},
-                )
+                response = await self.get(name, raw=True, **self.range_kwargs(name, week[0], week[-1]))
             except Exception:
-                events[week[0].isoformat()] = None
+                return default
+            return default if response is None else project(response, exclude)
+
+        return list(await asyncio.gather(*map(load_week, weeks)))
+
+    async def sync_marks(
+        self,
+        weeks: list[list[datetime.date]],
+        wide: bool = False
+    ) -> tuple[dict[str, typing.Any], list[MarksPayload]]:
+        """
+        Incremental sync of marks of the weeks, merged into the cached ``MARKS_BY_DATE``.
+
+        Only the last ``MARKS_SYNC_DAYS`` days are requested and replace the cached marks of these days,
+        all the weeks are reloaded once per ``MARKS_FULL_SYNC`` seconds, when the weeks or the student changed.
+        The newest ``updated_at`` is kept as the watermark of the student.
 
+        :return: Weeks with ``watermark``, ``synced`` (time of the last full sync) and ``student_id`` keys
+            and marks changed since the previous watermark.
+        """
+        student_id = self.context.student_id
+        cached = await self.get_cached(DataType.MARKS_BY_DATE, raw=True) or {}
+        now, today = get_datetime(), get_date()
+        since = max(today - timedelta(days=MARKS_SYNC_DAYS), weeks[0][0])
+        full = (
+            cached.get("student_id") != student_id
+            or any(week[0].isoformat() not in cached for week in weeks)
+            or not cached.get("synced")
+            or (now - datetime.datetime.fromisoformat(cached["synced"])).total_seconds() >= MARKS_FULL_SYNC
+            or since > today
+        )
+
+        if full:
+            values = await self.load_weeks(DataType.MARKS_BY_DATE, weeks, [], wide=wide)
+            data = {week[0].isoformat(): value for week, value in zip(weeks, values)} | {"synced": now.isoformat()}
+        else:
             try:
-                homeworks[week[0].isoformat()] = (await self.get(
-                    DataType.HOMEWORKS,
-                    from_date=week[0],
-                    to_date=week[-1]
-                )).model_dump(
-                    mode="json",
-                )
+                recent = await self.get(DataType.MARKS_BY_DATE, raw=True, from_date=since, to_date=today)
             except Exception:
-                homeworks[week[0].isoformat()] = None
-
-        self.data[DataType.EVENTS] = events
-        self.data[DataType.HOMEWORKS] = homeworks
-        self.data[DataType.MARKS_BY_DATE] = marks_by_date
+                recent = None
 
-        await self.load(DataType.MARKS_BY_SUBJECT)
+            data = {week[0].isoformat(): cached[week[0].isoformat()] for week in weeks} | {"synced": cached["synced"]}
+            if recent is not None:
+                fresh = UserData.split_weeks(
+                    DataType.MARKS_BY_DATE,
+                    recent,
+                    [week[0] for week in weeks if week[-1] >= since]
+                )
+                for week, week_data in fresh.items():
+                    payload = [
+                        mark
+                        for mark in (data[week.isoformat()] or {}).get("payload") or []
+                        if not since <= datetime.date.fromisoformat(str(mark.get("date"))[:10]) <= today
+                    ] + week_data["payload"]
+                    data[week.isoformat()] = {"payload": sorted(payload, key=lambda mark: str(mark.get("date")))}
+
+        watermark = _parse_updated_at(cached.get("watermark")) if cached.get("student_id") == student_id else None
+        updated = [
+            (updated_at, mark)
+            for week in weeks
+            for mark in (data[week[0].isoformat()] or {}).get("payload") or []
+            if (updated_at := _parse_updated_at(mark.get("updated_at")))
+        ]
+        # without a watermark it is the first sync of the student: nothing is reported as changed
+        changed = [
+            MarksPayload.model_validate(mark)
+            for updated_at, mark in updated
+            if watermark is not None and updated_at > watermark
+        ]
+        newest = max([updated_at for updated_at, _ in updated] + ([watermark] if watermark else []), default=None)
+        data["watermark"] = newest.isoformat() if newest else None
+        data["student_id"] = student_id
+        return data, changed
 
-        await self.cache_data()
+    @staticmethod
+    def split_weeks(name: DataType, response: dict, weeks: list[datetime.date]) -> dict[datetime.date, dict]:
+        """
+        Split raw events/marks over several weeks into raw responses of each week (by its first day).
+        Items without a date are kept in the first week, as the whole range was requested from it.
+        """
+        field, date_field = UserData.WIDE_RANGE[name]
+        buckets: dict[datetime.date, list] = {week: [] for week in weeks}
+        for item in response.get(field) or []:
+            if not (value := item.get(date_field)):
+                if buckets:
+                    logger.debug(f"[UserData] {name} item without {date_field} is put to the week of {min(buckets)}")
+                    buckets[min(buckets)].append(item)
+                continue
+            day = datetime.date.fromisoformat(str(value)[:10])
+            if (bucket := buckets.get(day - timedelta(days=day.weekday()))) is not None:
+                bucket.append(item)
+
+        return {
+            week: response | {field: items} | ({"total_count": len(items)} if name == DataType.EVENTS else {})
+            for week, items in buckets.items()
+        }
+
+    def _dump(self, name: DataType, raw: bool = False) -> bytes:
+        return codec.encode(
+            self.data[name].model_dump(
+                mode="json",
+                exclude=(
+                    {"children": {"__all__": {"groups"}, "hash": True}}
+                    if name == DataType.PROFILE
+                    else {"response": {"__all__": {"class_unit_ids"}}}
+                    if name == DataType.EVENTS
+                    else None
+                ),
+                exclude_none=True,
+                exclude_unset=True,
+            ) if not raw else self.data[name]
+        )
 
     async def cache_data(self, name: DataType = None, raw: bool = False):
-        if name:
-            await database.redis.set(
-                f"user:{self.db_user.id}:{name}",
-                pickle.dumps(
-                    self.data[name].model_dump(
-                        mode="json",
-                        exclude=(
-                            {"children": {"__all__": {"groups"}, "hash": True}}
-                            if name == DataType.PROFILE
-                            else {"response": {"__all__": {"class_unit_ids"}}}
-                            if name == DataType.EVENTS
-                            else None
-                        ),
-                        exclude_none=True,
-                        exclude_unset=True,
-                    ) if not raw else self.data[name]
-                )
-            )
-        else:
-            for name in self.data:
-                if name != DataType.PROFILE_ID:
-                    await self.cache_data(name, raw=True if name in [
-                        DataType.EVENTS,
-                        DataType.HOMEWORKS,
-                        DataType.MARKS_BY_DATE
-                    ] else False)
+        """Cache the loaded data. Without ``name`` all of it is written in one transaction (single round trip)."""
+        async with database.redis.pipeline(transaction=True) as pipeline:
+            for data_type in ([name] if name else self.data):
+                if data_type == DataType.PROFILE_ID:
+                    continue
+
+                if data_type not in UserData.WEEKLY:
+                    pipeline.set(
+                        self._cache_key(data_type),
+                        self._dump(data_type, raw or not isinstance(self.data[data_type], BaseModel)),
+                        ex=CACHE_TTL.get(data_type) or None
+                    )
+                    pipeline.delete(cache_keys.legacy_key(self.db_user.id, data_type))
+                    pipeline.hset(self._loaded_key(), data_type.value, get_datetime().isoformat())
+                    if CACHE_TTL.get(data_type):
+                        pipeline.expire(self._loaded_key(), max(CACHE_TTL.values()))
+                    continue
+
+                data = dict(self.data[data_type])
+                loaded_at = data.pop("datetime", None) or get_datetime().isoformat()
+                weeks = {key: data.pop(key) for key in list(data) if _is_week(key)}
+                # failed weeks are empty, the cached ones are kept
+                self._cache_weeks(pipeline, data_type, {week: value for week, value in weeks.items() if value}, loaded_at)
+                if data:
+                    pipeline.set(self._meta_key(data_type), codec.encode(data), ex=CACHE_TTL.get(data_type) or None)
+            await pipeline.execute()
 
     async def log(self, name: str, success: bool = True, next_func=None):
         logger.log("MINIDEBUG", f"[UserData::loading::{'failed' if not success else 'success'}] {self.db_user.id} {name} is{' NOT' if not success else ''} loaded! ")
@@ -366,13 +776,8 @@ class UserData:
         if token == "<TOKEN>" or (await self.token_is_expired(token)):
             raise RuntimeError("TokenExpired")
 
-        data = jwt.decode(token, options={"verify_signature": False})
-        exp = datetime.datetime.fromtimestamp(
-            data["exp"], tz=TIMEZONE
-        )
-        now = get_datetime()
-
-        if abs(exp - now).total_seconds() <= 60 * 60 * 24 * 3:
+        # usually the token is refreshed in advance by ``refresh_scheduler``
+        if token_claims(token)["exp"] - time.time() <= TOKEN_REFRESH_BEFORE:
             try:
                 self.db_user.token = await UserData.refresh_token(token)
                 return True
@@ -381,8 +786,4 @@ class UserData:
 
     @staticmethod
     async def token_is_expired(token: str):
-        data = jwt.decode(token, options={"verify_signature": False})
-        exp = datetime.datetime.fromtimestamp(
-            data["exp"], tz=TIMEZONE
-        )
-        return get_datetime() > exp
+        return time.time() > token_claims(token)["exp"]
@@ -0,0 +1,62 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import enum
+
+
+class DataType(enum.Enum):
+    MATERIAL_LAUNCH_LINK = "material_launch_link"
+    PROFILE_ID = "profile_id"
+    PROFILE = "profile"
+    EVENTS = "events"
+    HOMEWORKS = "homeworks"
+    MARKS_BY_DATE = "marks_by_date"
+    MARKS_BY_SUBJECT = "marks_by_subject"
+    SCHEDULE_ITEM = "schedule_item"
+    MARK = "mark"
+
+
+# Keys of data of users cached in Redis, all of them start with ``user:<id>:<type>``
+# (except ``loaded_key``), so they are grouped by ``key_type``
+
+def data_key(user_id: str | int, name: DataType) -> str:
+    return f"user:{user_id}:{name.value}"
+
+
+def week_key(user_id: str | int, name: DataType, week: str) -> str:
+    return f"user:{user_id}:{name.value}:{week}"
+
+
+def weeks_key(user_id: str | int, name: DataType) -> str:
+    """Index of cached weeks: hash of the first day of a week -> time it was loaded at"""
+    return f"user:{user_id}:{name.value}:weeks"
+
+
+def meta_key(user_id: str | int, name: DataType) -> str:
+    return f"user:{user_id}:{name.value}:meta"
+
+
+def loaded_key(user_id: str | int) -> str:
+    """Times the data which isn't week-keyed was cached at: ``DataType`` value -> time"""
+    return f"user:{user_id}:loaded"
+
+
+def legacy_key(user_id: str | int, name: DataType) -> str:
+    """Key of the data before keys were named by ``DataType`` values (``user:<id>:DataType.PROFILE``)"""
+    return f"user:{user_id}:{name}"
+
+
+def user_keys(user_id: str | int, weeks: dict[DataType, list[str]]) -> list[str]:
+    """All keys of cached data of the user, ``weeks`` are weeks from the indexes of week-keyed data"""
+    return [loaded_key(user_id)] + [
+        key(user_id, name)
+        for name in DataType
+        for key in (data_key, weeks_key, meta_key, legacy_key)
+    ] + [week_key(user_id, name, week) for name, names_weeks in weeks.items() for week in names_weeks]
+
+
+def key_type(key: str) -> str:
+    """Type of data (``DataType`` value) by its key, ``loaded`` for ``loaded_key``"""
+    return key.split(":")[2].removeprefix("DataType.").lower()
@@ -0,0 +1,92 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import json
+import os
+import pickle
+import zlib
+from typing import Any
+
+from loguru import logger
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"OD"
+VERSION = 1
+
+JSON, MSGPACK = 0, 1
+NONE, ZLIB, ZSTD = 0, 1, 2
+
+
+class Codec:
+    """
+    Serialization of values stored in Redis.
+
+    Values are written as ``MAGIC + version + format + compression`` header and JSON/msgpack payload,
+    compressed with zstd (zlib if it isn't installed) when longer than ``compress_threshold`` bytes.
+    Values without the header are legacy pickles and are still decoded, they are rewritten on the next save.
+    """
+
+    def __init__(self, format: str = "msgpack", compress_threshold: int = 1024) -> None:
+        self.format = MSGPACK if format == "msgpack" and msgpack is not None else JSON
+        self.compress_threshold = compress_threshold
+        self._zstd_compressor = zstandard.ZstdCompressor() if zstandard is not None else None
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+        if format == "msgpack" and msgpack is None:
+            logger.warning("[Codec] msgpack isn't installed, cached values are stored as JSON")
+        if compress_threshold >= 0 and zstandard is None:
+            logger.warning("[Codec] zstandard isn't installed, cached values are compressed with zlib")
+
+    def encode(self, value: Any) -> bytes:
+        if self.format == MSGPACK:
+            payload = msgpack.packb(value, use_bin_type=True)
+        else:
+            payload = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+        compression = NONE
+        if 0 <= self.compress_threshold < len(payload):
+            if self._zstd_compressor is not None:
+                payload, compression = self._zstd_compressor.compress(payload), ZSTD
+            else:
+                payload, compression = zlib.compress(payload), ZLIB
+
+        return MAGIC + bytes((VERSION, self.format, compression)) + payload
+
+    def decode(self, raw: bytes) -> Any:
+        if not raw.startswith(MAGIC):
+            return pickle.loads(raw)  # noqa: S301
+
+        version, format, compression = raw[2:5]
+        if version != VERSION:
+            raise ValueError(f"Unsupported codec version {version}")
+
+        payload = raw[5:]
+        if compression == ZSTD:
+            if self._zstd_decompressor is None:
+                raise RuntimeError("zstandard is required to decode this value")
+            payload = self._zstd_decompressor.decompress(payload)
+        elif compression == ZLIB:
+            payload = zlib.decompress(payload)
+
+        if format == MSGPACK:
+            if msgpack is None:
+                raise RuntimeError("msgpack is required to decode this value")
+            return msgpack.unpackb(payload, raw=False)
+        return json.loads(payload)
+
+
+codec = Codec(
+    format=os.environ.get("CACHE_CODEC", "msgpack"),
+    compress_threshold=int(os.environ.get("CACHE_COMPRESS_THRESHOLD", 1024))
+)
@@ -3,14 +3,88 @@
 #        https://opensource.org/licenses/MIT
 #           https://github.com/OctoDiary
 
+import contextlib
+import json
 import os
-import pickle
-from typing import Any
+from contextvars import ContextVar
+from types import MappingProxyType
+from typing import Any, Iterable, Mapping, Optional
 
-from lightdb import LightDB
 from redis.asyncio import Redis
 
 from core.misc.apis import APIs
+from core.services import cache_keys
+from core.services.cache_keys import DataType
+from core.services.codecs import codec
+from core.services.tokens import refresh_scheduler
+from core.services.storages import (
+    BaseStorage,
+    BufferedLightDB,
+    JSONStorage,
+    RedisStorage,
+    SQLiteStorage,
+    UsersIndex,
+    WALStorage,
+    flusher
+)
+
+STORAGES: dict[str, type[BaseStorage]] = {
+    "json": JSONStorage,
+    "wal": WALStorage,
+    "sqlite": SQLiteStorage,
+    "redis": RedisStorage,
+}
+
+_DELETED = object()
+
+
+class Settings(BufferedLightDB):
+    """
+    Bot settings.
+
+    Values of ``SETS`` keys are kept as in-memory sets, so membership checks are O(1),
+    and they are written as lists by the background flusher.
+    """
+
+    SETS = ("full-users-ids",)
+
+    def __init__(self, location: str) -> None:
+        super().__init__(location)
+        self.sets: dict[str, set] = {key: set(dict.get(self, key, [])) for key in self.SETS}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self.sets:
+            return self.sets[key]
+        return super().get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        if key in self.sets:
+            self.sets[key] = set(value)
+            self.save()
+            return
+        super().set(key, value)
+
+    def add(self, key: str, value: Any) -> bool:
+        """Add the value to the set. Returns True if it is new."""
+        if value in self.sets[key]:
+            return False
+        self.sets[key].add(value)
+        self.save()
+        return True
+
+    def dump(self) -> str:
+        return json.dumps({**self, **{key: list(values) for key, values in self.sets.items()}}, ensure_ascii=False)
+
+
+class UserBatch:
+    """Pending writes of one user, collected by ``User.batch``/``User.transaction``"""
+
+    def __init__(self) -> None:
+        self.changes: dict[str, Any] = {}
+        self.closed = False
+
+
+_batches: ContextVar[Mapping[str, UserBatch]] = ContextVar("batches", default=MappingProxyType({}))
 
 
 class User:
@@ -22,42 +96,108 @@ class User:
 
     @property
     def apis(self) -> APIs:
-        return APIs(self.token, self.system.lower().replace("_", ""))
+        return APIs.get(self.token, self.system.lower().replace("_", ""))
 
     @property
     def id(self):
         return self.__id
 
+    def _batch(self) -> Optional[UserBatch]:
+        batch = _batches.get().get(self.__id)
+        return batch if batch is not None and not batch.closed else None
+
     def get(self, key: str, default: Any = None) -> Any:
+        if (batch := self._batch()) is not None and key in batch.changes:
+            value = batch.changes[key]
+            return default if value is _DELETED else value
         return self.__db.get_key(self.__id, key, default=default)
 
     def set(self, key: str, value: Any) -> None:
+        if (batch := self._batch()) is not None:
+            batch.changes[key] = value
+            return
         self.__db.set_key(self.__id, key, value)
 
     def pop(self, key: str) -> Any:
+        if (batch := self._batch()) is not None:
+            value = self.get(key, _DELETED)
+            if value is _DELETED:
+                raise KeyError(key)
+            batch.changes[key] = _DELETED
+            return value
         return self.__db.pop_key(self.__id, key)
 
     def pop_key(self, attr: str, key: str, default: Any = None) -> Any:
-        attr_value = self.__db.get_key(self.__id, attr)
+        attr_value = self.get(attr)
         if attr_value is None:
             return None
+        attr_value = dict(attr_value)
         value = attr_value.pop(key, default)
-        self.__db.set_key(self.__id, attr, attr_value)
+        self.set(attr, attr_value)
         return value
 
     def set_key(self, attr: str, key: str, value: Any) -> None:
-        attr_value = self.__db.get_key(self.__id, attr)
-        if attr_value is None:
-            attr_value = {}
+        attr_value = dict(self.get(attr) or {})
         attr_value[key] = value
-        self.__db.set_key(self.__id, attr, attr_value)
+        self.set(attr, attr_value)
 
     def get_key(self, attr: str, key: str, default: Any = None) -> Any:
-        attr_value = self.__db.get_key(self.__id, attr)
+        attr_value = self.get(attr)
         if attr_value is None:
             return default
         return attr_value.get(key, default)
 
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Collect writes in memory and save them at once on exit (even if an exception was raised).
+        Repeated writes of the same key are collapsed. Nested batches of the same user are merged into the outer one.
+
+        >>> with user.batch():
+        ...     user.token = token
+        ...     user.system = system
+        """
+        if self._batch() is not None:
+            yield self._batch()
+            return
+
+        batch = UserBatch()
+        token = _batches.set({**_batches.get(), self.__id: batch})
+        try:
+            yield batch
+        finally:
+            _batches.reset(token)
+            batch.closed = True
+            self.__db.apply_batch(self.__id, batch)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """
+        Like ``batch``, but pending writes are dropped if an exception was raised.
+        Within an outer batch it is a savepoint: only writes made inside the transaction are dropped.
+        """
+        if (outer := self._batch()) is not None:
+            savepoint = dict(outer.changes)
+            try:
+                yield outer
+            except BaseException:
+                outer.changes.clear()
+                outer.changes.update(savepoint)
+                raise
+            return
+
+        batch = UserBatch()
+        token = _batches.set({**_batches.get(), self.__id: batch})
+        try:
+            yield batch
+        except BaseException:
+            batch.changes.clear()
+            raise
+        finally:
+            _batches.reset(token)
+            batch.closed = True
+            self.__db.apply_batch(self.__id, batch)
+
     def save(self):
         self.__db.save()
 
@@ -115,9 +255,11 @@ class User:
         self.__db.cache.save()
 
 
-class Database(LightDB):
+class Database:
     """
     Main database class
+
+    Users are kept in a pluggable storage (see ``core.services.storages``), selected by the ``USERS_STORAGE`` env.
     """
     __instance__ = None
 
@@ -127,9 +269,11 @@ class Database(LightDB):
         return cls.__instance__
 
     def __init__(self) -> None:
-        super().__init__(location="files/users_db.json")
-        self.settings = LightDB("files/settings.json")
-        self.cache = LightDB("files/cache.json")
+        self.storage: BaseStorage = STORAGES[os.environ.get("USERS_STORAGE", "json")](location="files/users_db.json")
+        self.settings = Settings("files/settings.json")
+        # storages without native indexes get the in-memory one
+        self.index = UsersIndex(self.storage, self.blocked_users) if not self.storage.indexed else None
+        self.cache = BufferedLightDB("files/cache.json")
         self.redis = Redis.from_url(os.environ.get("REDIS_URL", "redis://127.0.0.1:6379/") + "20")
         self.redis._queue = []
 
@@ -153,6 +297,126 @@ class Database(LightDB):
             else super().__setattr__(__name, __value)
         )
 
+    def keys(self):
+        return self.storage.keys()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.storage.get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        self._discard_batch(key)
+        self.storage.set(key, value)
+        self._after_write(key)
+
+    def pop(self, key: str) -> Any:
+        self._discard_batch(key)
+        popped = self.storage.pop(key)
+        self._after_write(key)
+        self.redis._queue.append(self.purge_cache(key))
+        return popped
+
+    def get_key(self, name: str, key: str, default: Any = None) -> Any:
+        return self.storage.get_key(name, key, default)
+
+    def set_key(self, name: str, key: str, value: Any) -> None:
+        self.storage.set_key(name, key, value)
+        self._after_write(name)
+
+    def pop_key(self, name: str, key: str) -> Any:
+        popped = self.storage.pop_key(name, key)
+        self._after_write(name)
+        return popped
+
+    def set_keys(self, name: str, values: dict[str, Any], removed: Iterable[str] = ()) -> None:
+        self.storage.set_keys(name, values, removed)
+        self._after_write(name)
+
+    def reload(self, key: str | int) -> None:
+        """Update indexes and the token refresh of the user changed outside of this process"""
+        self._after_write(key)
+
+    def _after_write(self, key: str | int) -> None:
+        """Update indexes and reschedule the token refresh after a write of the user is committed"""
+        user = self.storage.get(key)
+        if self.index is not None:
+            self.index.update(str(key), user)
+
+        token = user.get("token") if isinstance(user, dict) else None
+        if not token or not refresh_scheduler.is_current(key, token):
+            refresh_scheduler.schedule(key, token)
+
+    @staticmethod
+    def _discard_batch(key: str | int) -> None:
+        # the whole user is replaced, so pending writes of the update mustn't bring old data back
+        if (batch := _batches.get().get(str(key))) is not None:
+            batch.changes.clear()
+
+    def apply_batch(self, user_id: str, batch: UserBatch) -> None:
+        if not batch.changes:
+            return
+
+        self.set_keys(
+            user_id,
+            {key: value for key, value in batch.changes.items() if value is not _DELETED},
+            [
+                key
+                for key, value in batch.changes.items()
+                if value is _DELETED and self.get_key(user_id, key, _DELETED) is not _DELETED
+            ]
+        )
+
+    def select_users(
+        self,
+        system: Optional[str] = None,
+        authorized: Optional[bool] = None,
+        notifications: Optional[bool] = None,
+        scheduler: Optional[bool] = None,
+        blocked: Optional[bool] = None,
+    ) -> list[str]:
+        """
+        Ids of registered users matching the filters, see ``BaseStorage.select``.
+        Answered by indexes in O(result), without scanning all users.
+
+        >>> database.select_users(system="mes", authorized=True, blocked=False)
+        """
+        if self.index is not None:
+            return self.index.select(
+                system=system,
+                authorized=authorized,
+                notifications=notifications,
+                scheduler=scheduler,
+                blocked=blocked
+            )
+
+        users = self.storage.select(
+            system=system,
+            authorized=authorized,
+            notifications=notifications,
+            scheduler=scheduler
+        )
+        if blocked is not None:
+            blocked_users = set(self.blocked_users)
+            users = [user_id for user_id in users if (int(user_id) in blocked_users) == blocked]
+        return users
+
+    def save(self) -> None:
+        self.storage.save()
+
+    def close(self) -> None:
+        self.storage.close()
+        self.settings.save()
+        self.cache.save()
+        flusher.flush()
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.storage
+
+    def __iter__(self):
+        return iter(self.storage)
+
+    def __len__(self) -> int:
+        return len(self.storage)
+
     def user(self, id: str | int) -> User:
         return User(self, str(id))
 
@@ -179,13 +443,44 @@ class Database(LightDB):
     @blocked_users.setter
     def blocked_users(self, value: list[int]) -> None:
         self.settings.set("blocked-users", value)
+        if self.index is not None:
+            self.index.blocked = set(map(str, value))
+
+    async def purge_cache(self, user_id: str | int) -> int:
+        """Delete all cached data of the user (see ``cache_keys``). Returns count of deleted keys."""
+        async with self.redis.pipeline(transaction=False) as pipeline:
+            for name in DataType:
+                pipeline.hkeys(cache_keys.weeks_key(user_id, name))
+            weeks = await pipeline.execute()
+
+        return await self.redis.delete(*cache_keys.user_keys(user_id, {
+            name: [week.decode() for week in names_weeks] for name, names_weeks in zip(DataType, weeks)
+        }))
+
+    async def cache_stats(self, sample: int = 50) -> dict[str, tuple[int, int]]:
+        """
+        Count of cached ``user:<id>:<type>[:<week>]`` keys and their estimated memory (bytes) by type.
+        Memory is measured for up to ``sample`` keys of each type and extrapolated.
+        """
+        keys: dict[str, list[bytes]] = {}
+        async for key in self.redis.scan_iter(match="user:*", count=1000):
+            keys.setdefault(cache_keys.key_type(key.decode()), []).append(key)
+
+        stats = {}
+        for name, names_keys in keys.items():
+            async with self.redis.pipeline(transaction=False) as pipeline:
+                for key in names_keys[:sample]:
+                    pipeline.memory_usage(key)
+                sizes = [size for size in await pipeline.execute(raise_on_error=False) if isinstance(size, int)]
+            stats[name] = (len(names_keys), sum(sizes) * len(names_keys) // len(sizes) if sizes else 0)
+        return stats
 
     async def new_feedback(self, data: dict):
-        await self.redis.set(f"feedback:{data['number']}", pickle.dumps(data))
+        await self.redis.set(f"feedback:{data['number']}", codec.encode(data))
 
     async def get_feedback(self, number: int):
         raw = await self.redis.get(f"feedback:{number}")
-        return pickle.loads(raw) if raw else None
+        return codec.decode(raw) if raw else None
 
     async def delete_feedback(self, number: int):
         data = await self.get_feedback(number)
@@ -0,0 +1,24 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+from core.misc.buffered import BufferedLightDB, Flusher, flusher
+from core.services.storages.base import BaseStorage
+from core.services.storages.index import UsersIndex
+from core.services.storages.json_file import JSONStorage
+from core.services.storages.redis_hash import RedisStorage
+from core.services.storages.sqlite import SQLiteStorage
+from core.services.storages.wal import WALStorage
+
+__all__ = [
+    "BaseStorage",
+    "BufferedLightDB",
+    "Flusher",
+    "JSONStorage",
+    "RedisStorage",
+    "SQLiteStorage",
+    "UsersIndex",
+    "WALStorage",
+    "flusher"
+]
@@ -0,0 +1,101 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+from typing import Any, Iterable, Iterator, KeysView, Optional
+
+
+class BaseStorage:
+    """
+    Base class for users storage backends.
+
+    Storages keep the LightDB interface (``get``/``set``/``pop`` and their nested ``*_key`` versions),
+    so ``Database`` and ``User`` work with any of them in the same way.
+    """
+
+    indexed: bool = False  # ``select`` is answered by the storage itself, without scanning users
+
+    def keys(self) -> KeysView[str]:
+        raise NotImplementedError
+
+    def get(self, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    def items(self) -> Iterable[tuple[str, Any]]:
+        """All users, storages override it to read them in bulk"""
+        return ((key, self.get(key)) for key in list(self.keys()))
+
+    def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def pop(self, key: str) -> Any:
+        raise NotImplementedError
+
+    def get_key(self, name: str, key: str, default: Any = None) -> Any:
+        value = self.get(name)
+        if value is None:
+            return default
+        return value.get(str(key), default)
+
+    def set_key(self, name: str, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def pop_key(self, name: str, key: str) -> Any:
+        raise NotImplementedError
+
+    def set_keys(self, name: str, values: dict[str, Any], removed: Iterable[str] = ()) -> None:
+        """Set and remove several keys of a nested dictionary. Storages override it to persist them in one write."""
+        for key, value in values.items():
+            self.set_key(name, key, value)
+        for key in removed:
+            self.pop_key(name, key)
+
+    def select(
+        self,
+        system: Optional[str] = None,
+        authorized: Optional[bool] = None,
+        notifications: Optional[bool] = None,
+        scheduler: Optional[bool] = None,
+    ) -> list[str]:
+        """
+        Get ids of registered users (with a system), matching the filters.
+
+        :param system: Only users of this system.
+        :param authorized: Users with (or without) a token.
+        :param notifications: Users with (or without) enabled marks notifications.
+        :param scheduler: Users with (or without) a non-empty scheduler.
+        """
+        result = []
+        for key in list(self.keys()):
+            user = self.get(key)
+            if not key.isdigit() or not isinstance(user, dict) or not user.get("system"):
+                continue
+            if system is not None and user["system"] != system:
+                continue
+            if authorized is not None and bool(user.get("token")) != authorized:
+                continue
+            if notifications is not None and bool(
+                ((user.get("settings") or {}).get("notifications") or {}).get("create_mark", False)
+            ) != notifications:
+                continue
+            if scheduler is not None and bool(user.get("scheduler")) != scheduler:
+                continue
+            result.append(key)
+        return result
+
+    def save(self) -> None:
+        """Persist the whole current state of the storage"""
+
+    def close(self) -> None:
+        """Release files/connections used by the storage"""
+        self.save()
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.keys()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
@@ -0,0 +1,82 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+from typing import Any, Iterable, Optional
+
+from core.services.storages.base import BaseStorage
+
+
+class UsersIndex:
+    """
+    In-memory secondary indexes over users, so ``select`` costs O(result) instead of a scan of all users.
+
+    ``Database`` updates it after every write of a user.
+    """
+
+    def __init__(self, storage: BaseStorage, blocked: Iterable[int] = ()) -> None:
+        self.systems: dict[str, set[str]] = {}
+        self.authorized: set[str] = set()
+        self.notifications: set[str] = set()
+        self.scheduler: set[str] = set()
+        self.blocked: set[str] = set(map(str, blocked))
+
+        for key, user in list(storage.items()):
+            self.update(key, user)
+
+    def update(self, key: str, user: Optional[dict[str, Any]]) -> None:
+        key = str(key)
+        for users in (*self.systems.values(), self.authorized, self.notifications, self.scheduler):
+            users.discard(key)
+
+        if not key.isdigit() or not isinstance(user, dict) or not user.get("system"):
+            return
+
+        self.systems.setdefault(user["system"], set()).add(key)
+        if user.get("token"):
+            self.authorized.add(key)
+        if ((user.get("settings") or {}).get("notifications") or {}).get("create_mark", False):
+            self.notifications.add(key)
+        if user.get("scheduler"):
+            self.scheduler.add(key)
+
+    def select(
+        self,
+        system: Optional[str] = None,
+        authorized: Optional[bool] = None,
+        notifications: Optional[bool] = None,
+        scheduler: Optional[bool] = None,
+        blocked: Optional[bool] = None,
+    ) -> list[str]:
+        """See ``BaseStorage.select``, ``blocked`` filters by ``Database.blocked_users``"""
+        filters = [
+            (users, value)
+            for users, value in (
+                (self.authorized, authorized),
+                (self.notifications, notifications),
+                (self.scheduler, scheduler),
+                (self.blocked, blocked),
+            )
+            if value is not None
+        ]
+        if system is not None:
+            filters.append((self.systems.get(system, set()), True))
+
+        # iterate over the smallest set all matching users must be in, instead of all registered users
+        included = [users for users, value in filters if value]
+        if not included:
+            return [
+                key
+                for users in self.systems.values()
+                for key in users
+                if all((key in users_) == value for users_, value in filters)
+            ]
+
+        smallest = min(included, key=len)
+        return [
+            key
+            for key in smallest
+            if any(key in users for users in self.systems.values())
+            and all((key in users_) == value for users_, value in filters)
+        ]
@@ -0,0 +1,23 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+from typing import Any, Iterable
+
+from core.services.storages.base import BaseStorage
+from core.misc.buffered import BufferedLightDB
+
+
+class JSONStorage(BufferedLightDB, BaseStorage):
+    """Users storage in a single JSON file, rewritten by the background flusher (see ``BufferedLightDB``)"""
+
+    def set_keys(self, name: str, values: dict[str, Any], removed: Iterable[str] = ()) -> None:
+        user = self.setdefault(str(name), {})
+        user.update(values)
+        for key in removed:
+            user.pop(key, None)
+        self.save()
+
+    def close(self) -> None:
+        self.save()
@@ -0,0 +1,290 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, Optional
+
+import redis
+from loguru import logger
+from redis.asyncio import Redis as AsyncRedis
+
+from core.misc.lru import LRUCache
+from core.services.storages.base import BaseStorage
+
+USERS_KEY = "db:users"
+USER_KEY = "db:user:{}"
+# ``<origin>:<id>`` is published here with every write of a user, origin is unique for each process
+CHANGES_CHANNEL = "db:users:changes"
+_MISSING = object()
+
+
+class RedisStorage(BaseStorage):
+    """
+    Users storage in Redis, one hash per user (``db:user:<id>``, a JSON value per field) and
+    ``db:users`` set with all ids, so several bot processes can share users.
+
+    Ids of users are kept in memory and users in an in-process LRU cache of ``cache_size`` users
+    (``USERS_CACHE_SIZE`` env, all users by default): they are preloaded with one pipelined pass
+    by ``items`` when the index is built, so reads don't wait for Redis unless the cache is limited.
+    Writes update the cache at once and are sent to Redis in order by a background thread,
+    so they never block the event loop.
+    Users changed by other processes are re-read by ``invalidations``, which listens to ``CHANGES_CHANNEL``.
+    On the first start the users are migrated from the LightDB file at ``location``.
+    """
+
+    def __init__(self, location: str, url: Optional[str] = None, cache_size: Optional[int] = None) -> None:
+        self.url = url or os.environ.get("REDIS_URL", "redis://127.0.0.1:6379/") + "20"
+        self.origin = uuid.uuid4().hex
+        self._client = redis.Redis.from_url(self.url)
+        if cache_size is None:
+            cache_size = int(os.environ.get("USERS_CACHE_SIZE", 0))
+        self._cache = LRUCache(cache_size or sys.maxsize)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="RedisStorageWriter")
+        self._lock = threading.Lock()
+        self._pending: dict[str, int] = {}  # count of queued writes by user
+        self._submitted: dict[str, int] = {}  # count of all writes by user, to notice ones made while it is re-read
+
+        if not self._client.exists(USERS_KEY) and Path(location).exists():
+            self.migrate_json(location)
+        self._keys = {key.decode() for key in self._client.smembers(USERS_KEY)}
+
+    @staticmethod
+    def _encode(user: dict[str, Any]) -> dict[str, str]:
+        return {key: json.dumps(value, ensure_ascii=False) for key, value in user.items()}
+
+    @staticmethod
+    def _decode(fields: dict[bytes, bytes]) -> dict[str, Any]:
+        return {key.decode(): json.loads(value) for key, value in fields.items()}
+
+    def _write_user(self, pipeline: redis.client.Pipeline, key: str, user: dict[str, Any]) -> None:
+        pipeline.delete(USER_KEY.format(key))
+        if user:
+            pipeline.hset(USER_KEY.format(key), mapping=self._encode(user))
+        pipeline.sadd(USERS_KEY, key)
+
+    def _submit(self, key: str, write: Callable[[redis.client.Pipeline], None]) -> None:
+        """Send the write of the user to Redis in the background thread, after the previously queued ones"""
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + 1
+        self._submitted[key] = self._submitted.get(key, 0) + 1
+
+        def run() -> None:
+            try:
+                with self._client.pipeline() as pipeline:
+                    write(pipeline)
+                    pipeline.publish(CHANGES_CHANNEL, f"{self.origin}:{key}")
+                    pipeline.execute()
+            except Exception:
+                logger.exception(f"[RedisStorage] Failed to write user {key}")
+            finally:
+                with self._lock:
+                    if (pending := self._pending[key] - 1) > 0:
+                        self._pending[key] = pending
+                    else:
+                        del self._pending[key]
+
+        self._writer.submit(run)
+
+    def flush(self) -> None:
+        """Wait until all queued writes are sent"""
+        self._writer.submit(lambda: None).result()
+
+    def keys(self) -> set[str]:
+        return set(self._keys)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        key = str(key)
+        if (user := self._cache.get(key, _MISSING)) is not _MISSING:
+            return default if user is None else user
+        if key not in self._keys:
+            return default
+
+        # only with a limited cache, all users are preloaded otherwise
+        if key in self._pending:
+            # evicted from the cache before its writes were sent
+            self.flush()
+        user = self._decode(self._client.hgetall(USER_KEY.format(key)))
+        self._cache.set(key, user)
+        return user
+
+    def items(self, chunk: int = 1000) -> Iterator[tuple[str, Any]]:
+        """All users, read with pipelined ``HGETALL`` requests (``chunk`` users per round trip)"""
+        self.flush()
+        keys = list(self._keys)
+        for i in range(0, len(keys), chunk):
+            with self._client.pipeline(transaction=False) as pipeline:
+                for key in keys[i:i + chunk]:
+                    pipeline.hgetall(USER_KEY.format(key))
+                users = pipeline.execute()
+
+            for key, fields in zip(keys[i:i + chunk], users):
+                user = self._decode(fields)
+                self._cache.set(key, user)
+                yield key, user
+
+    def set(self, key: str, value: Any) -> None:
+        key = str(key)
+        self._keys.add(key)
+        self._cache.set(key, value)
+        self._submit(key, lambda pipeline: self._write_user(pipeline, key, value))
+
+    def pop(self, key: str) -> Any:
+        key = str(key)
+        popped = self.get(key, _MISSING)
+        if popped is _MISSING:
+            raise KeyError(key)
+
+        def write(pipeline: redis.client.Pipeline) -> None:
+            pipeline.delete(USER_KEY.format(key))
+            pipeline.srem(USERS_KEY, key)
+
+        self._keys.discard(key)
+        self._cache.set(key, None)
+        self._submit(key, write)
+        return popped
+
+    def get_key(self, name: str, key: str, default: Any = None) -> Any:
+        return (self.get(name) or {}).get(str(key), default)
+
+    def set_key(self, name: str, key: str, value: Any) -> None:
+        self.set_keys(name, {str(key): value})
+
+    def pop_key(self, name: str, key: str) -> Any:
+        popped = self.get(name, {})[str(key)]
+        self.set_keys(name, {}, [str(key)])
+        return popped
+
+    def set_keys(self, name: str, values: dict[str, Any], removed: Iterable[str] = ()) -> None:
+        name, removed = str(name), list(removed)
+        user = dict(self.get(name) or {})
+        user.update(values)
+        for key in removed:
+            user.pop(key, None)
+
+        def write(pipeline: redis.client.Pipeline) -> None:
+            if values:
+                pipeline.hset(USER_KEY.format(name), mapping=self._encode(values))
+            if removed:
+                pipeline.hdel(USER_KEY.format(name), *removed)
+            pipeline.sadd(USERS_KEY, name)
+
+        self._keys.add(name)
+        self._cache.set(name, user)
+        self._submit(name, write)
+
+    def invalidate(self, key: str) -> None:
+        """Drop the cached user, the next read gets it from Redis"""
+        self._cache.pop(str(key))
+
+    async def _read(self, client: AsyncRedis, keys: list[str]) -> dict[str, Optional[dict[str, Any]]]:
+        """
+        Read users with the async ``client``: ``{id: user or None if it is removed}``.
+        Users written by this process while they were read are read again after the writes are sent.
+        """
+        users = {}
+        while keys:
+            if any(key in self._pending for key in keys):
+                await asyncio.to_thread(self.flush)
+            submitted = [self._submitted.get(key) for key in keys]
+            async with client.pipeline(transaction=False) as pipeline:
+                for key in keys:
+                    pipeline.hgetall(USER_KEY.format(key))
+                    pipeline.sismember(USERS_KEY, key)
+                results = await pipeline.execute()
+
+            changed = []
+            for key, count, fields, exists in zip(keys, submitted, results[::2], results[1::2]):
+                if count != self._submitted.get(key) or key in self._pending:
+                    changed.append(key)
+                else:
+                    users[key] = self._decode(fields) if exists else None
+            keys = changed
+        return users
+
+    def _update(self, users: dict[str, Optional[dict[str, Any]]]) -> list[str]:
+        """Put users read from Redis to the cache, returns ids of changed ones"""
+        changed = []
+        for key, user in users.items():
+            if self._cache.get(key, _MISSING) == user:
+                continue
+            if user is None:
+                self._keys.discard(key)
+            else:
+                self._keys.add(key)
+            self._cache.set(key, user)
+            changed.append(key)
+        return changed
+
+    async def _reload(self, client: AsyncRedis, chunk: int = 1000) -> AsyncIterator[str]:
+        """Re-read all users, yield ids of changed ones"""
+        keys = list(self._keys | {key.decode() for key in await client.smembers(USERS_KEY)})
+        for i in range(0, len(keys), chunk):
+            for key in self._update(await self._read(client, keys[i:i + chunk])):
+                yield key
+
+    async def invalidations(self, client: AsyncRedis) -> AsyncIterator[str]:
+        """
+        Listen to writes of users by other processes and yield their ids after re-reading them
+        (with the async ``client``) into the cache. Writes of this process are skipped by their origin.
+        If the connection is lost, it reconnects with a backoff and re-reads all cached users,
+        as writes made meanwhile are missed.
+        """
+        delay, reconnected = 1.0, False
+        while True:
+            pubsub = client.pubsub()
+            try:
+                await pubsub.subscribe(CHANGES_CHANNEL)
+                if reconnected:
+                    async for key in self._reload(client):
+                        yield key
+                    logger.info("[RedisStorage] Reconnected, users are re-read")
+                delay = 1.0
+
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    origin, key = message["data"].decode().split(":", 1)
+                    if origin == self.origin:
+                        continue
+
+                    for changed in self._update(await self._read(client, [key])):
+                        yield changed
+            except (redis.ConnectionError, redis.TimeoutError) as e:
+                logger.warning(f"[RedisStorage] Lost connection to changes of users ({e}), reconnecting in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay, reconnected = min(delay * 2, 60.0), True
+            finally:
+                await pubsub.aclose()
+
+    def close(self) -> None:
+        self._writer.shutdown(wait=True)
+        self._client.close()
+
+    def __contains__(self, key: object) -> bool:
+        return str(key) in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def migrate_json(self, location: str) -> int:
+        """One-shot migration of users from the LightDB file. Returns count of migrated users."""
+        with open(location, encoding="utf-8") as f:
+            users: dict[str, Any] = json.load(f)
+
+        users = {key: user for key, user in users.items() if isinstance(user, dict)}
+        with self._client.pipeline() as pipeline:
+            for key, user in users.items():
+                self._write_user(pipeline, key, user)
+            pipeline.execute()
+
+        logger.info(f"[RedisStorage] Migrated {len(users)} users from {location} to Redis")
+        return len(users)
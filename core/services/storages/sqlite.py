@@ -0,0 +1,178 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import json
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Iterable, KeysView, Optional
+
+from loguru import logger
+
+from core.services.storages.base import BaseStorage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    system TEXT,
+    has_token INTEGER NOT NULL DEFAULT 0,
+    profile_id INTEGER,
+    notifications INTEGER NOT NULL DEFAULT 0,
+    scheduler INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS users_system ON users (system, has_token);
+CREATE INDEX IF NOT EXISTS users_notifications ON users (notifications) WHERE notifications = 1;
+CREATE INDEX IF NOT EXISTS users_scheduler ON users (scheduler) WHERE scheduler = 1;
+"""
+
+UPSERT = (
+    "INSERT OR REPLACE INTO users (id, system, has_token, profile_id, notifications, scheduler, data) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+# Stored in their own columns, the rest of the user goes to the `data` JSON column
+COLUMNS = ("system", "profile_id")
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Users storage in SQLite, one row per user.
+
+    Rows are also kept in memory, so reads don't touch the database, and every write updates only one row.
+    ``select`` is answered by indexed columns without deserializing users.
+    On the first start the users are migrated from the LightDB file at ``location``.
+    """
+
+    indexed = True
+
+    def __init__(self, location: str) -> None:
+        self.location = Path(location).with_suffix(".sqlite3")
+        is_new = not self.location.exists()
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.location, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+        if is_new and Path(location).exists():
+            self.migrate_json(location)
+
+        self._data: dict[str, dict] = {}
+        for row in self._connection.execute("SELECT id, system, profile_id, data FROM users"):
+            self._data[row[0]] = self._from_row(*row[1:])
+
+    @staticmethod
+    def _from_row(system: Optional[str], profile_id: Optional[int], data: str) -> dict:
+        user = json.loads(data)
+        if system is not None:
+            user["system"] = system
+        if profile_id is not None:
+            user["profile_id"] = profile_id
+        return user
+
+    @staticmethod
+    def _to_row(key: str, user: dict) -> tuple:
+        return (
+            key,
+            user.get("system"),
+            int(bool(user.get("token"))),
+            user.get("profile_id"),
+            int(bool(((user.get("settings") or {}).get("notifications") or {}).get("create_mark", False))),
+            int(bool(user.get("scheduler"))),
+            json.dumps({k: v for k, v in user.items() if k not in COLUMNS}, ensure_ascii=False),
+        )
+
+    def _write(self, key: str) -> None:
+        with self._lock:
+            self._connection.execute(UPSERT, self._to_row(key, self._data[key]))
+
+    def keys(self) -> KeysView[str]:
+        return self._data.keys()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._data.get(str(key), default)
+
+    def set(self, key: str, value: Any) -> None:
+        self._data[str(key)] = value
+        self._write(str(key))
+
+    def pop(self, key: str) -> Any:
+        popped = self._data.pop(str(key))
+        with self._lock:
+            self._connection.execute("DELETE FROM users WHERE id = ?", (str(key),))
+        return popped
+
+    def set_key(self, name: str, key: str, value: Any) -> None:
+        self._data.setdefault(str(name), {})[str(key)] = value
+        self._write(str(name))
+
+    def pop_key(self, name: str, key: str) -> Any:
+        popped = self._data[str(name)].pop(str(key))
+        self._write(str(name))
+        return popped
+
+    def set_keys(self, name: str, values: dict[str, Any], removed: Iterable[str] = ()) -> None:
+        user = self._data.setdefault(str(name), {})
+        user.update(values)
+        for key in removed:
+            user.pop(key, None)
+        self._write(str(name))
+
+    def select(
+        self,
+        system: Optional[str] = None,
+        authorized: Optional[bool] = None,
+        notifications: Optional[bool] = None,
+        scheduler: Optional[bool] = None,
+    ) -> list[str]:
+        query, params = ["system IS NOT NULL AND system != ''"], []
+        if system is not None:
+            query.append("system = ?")
+            params.append(system)
+        for column, value in (("has_token", authorized), ("notifications", notifications), ("scheduler", scheduler)):
+            if value is not None:
+                query.append(f"{column} = ?")  # noqa: S608
+                params.append(int(value))
+
+        with self._lock:
+            return [
+                row[0]
+                for row in self._connection.execute(f"SELECT id FROM users WHERE {' AND '.join(query)}", params)  # noqa: S608
+                if row[0].isdigit()
+            ]
+
+    def save(self) -> None:
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                UPSERT,
+                [self._to_row(key, user) for key, user in self._data.items()]
+            )
+            self._connection.execute("COMMIT")
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def migrate_json(self, location: str) -> int:
+        """One-shot migration of users from the LightDB file. Returns count of migrated users."""
+        with open(location, encoding="utf-8") as f:
+            users: dict[str, Any] = json.load(f)
+
+        rows = [self._to_row(key, user) for key, user in users.items() if isinstance(user, dict)]
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(UPSERT, rows)
+            self._connection.execute("COMMIT")
+
+        logger.info(f"[SQLiteStorage] Migrated {len(rows)} users from {location} to {self.location}")
+        return len(rows)
+
+
+if __name__ == "__main__":
+    # Re-run the migration manually: python -m core.services.storages.sqlite [files/users_db.json]
+    SQLiteStorage("files/users_db.json").migrate_json(sys.argv[1] if len(sys.argv) > 1 else "files/users_db.json")
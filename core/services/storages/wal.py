@@ -0,0 +1,144 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Iterable, KeysView
+
+from loguru import logger
+
+from core.services.storages.base import BaseStorage
+
+
+class WALStorage(BaseStorage):
+    """
+    Users storage with an append-only write-ahead log.
+
+    Every write appends one JSON line to ``<location>.wal`` instead of rewriting the whole file.
+    The snapshot in ``<location>`` has the same format as the LightDB file, so switching between
+    ``json`` and ``wal`` storages doesn't need any migration.
+    ``compact`` folds the log into a new snapshot and is run periodically from the loops router.
+    """
+
+    def __init__(self, location: str, compact_threshold: int = 8 * 1024 * 1024) -> None:
+        self.location = Path(location)
+        self.log_location = self.location.with_name(self.location.name + ".wal")
+        self.old_log_location = self.location.with_name(self.location.name + ".wal.old")
+        self.compact_threshold = compact_threshold
+
+        self._lock = threading.Lock()
+        # the whole compaction (rotate -> write -> replace -> unlink) is run by one thread at a time
+        self._compaction_lock = threading.Lock()
+        self._data: dict[str, Any] = {}
+        self._load()
+        self._log = self.log_location.open("a", encoding="utf-8")
+        if self._log.tell() and not self.log_location.read_bytes().endswith(b"\n"):
+            self._log.write("\n")
+
+        if self.old_log_location.exists():
+            # previous compaction was interrupted, finish it
+            self.compact()
+
+    def _load(self) -> None:
+        if self.location.exists():
+            with self.location.open("r", encoding="utf-8") as f:
+                self._data = json.load(f)
+
+        for path in (self.old_log_location, self.log_location):
+            if not path.exists():
+                continue
+
+            with path.open("r", encoding="utf-8") as f:
+                for number, line in enumerate(f, start=1):
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        # torn write at the end of the log after a crash
+                        logger.warning(f"[WALStorage] Skipped broken record {path.name}:{number}")
+
+    def _apply(self, record: list) -> None:
+        match record:
+            case ["set", key, value]:
+                self._data[key] = value
+            case ["pop", key]:
+                self._data.pop(key, None)
+            case ["set_key", name, key, value]:
+                self._data.setdefault(name, {})[key] = value
+            case ["pop_key", name, key]:
+                self._data.get(name, {}).pop(key, None)
+            case ["set_keys", name, values, removed]:
+                user = self._data.setdefault(name, {})
+                user.update(values)
+                for key in removed:
+                    user.pop(key, None)
+
+    def _write(self, *record: Any) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._apply(list(record))
+            self._log.write(line)
+            self._log.flush()
+
+    def keys(self) -> KeysView[str]:
+        return self._data.keys()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._data.get(str(key), default)
+
+    def set(self, key: str, value: Any) -> None:
+        self._write("set", str(key), value)
+
+    def pop(self, key: str) -> Any:
+        popped = self._data[str(key)]
+        self._write("pop", str(key))
+        return popped
+
+    def set_key(self, name: str, key: str, value: Any) -> None:
+        self._write("set_key", str(name), str(key), value)
+
+    def pop_key(self, name: str, key: str) -> Any:
+        popped = self._data[str(name)][str(key)]
+        self._write("pop_key", str(name), str(key))
+        return popped
+
+    def set_keys(self, name: str, values: dict[str, Any], removed: Iterable[str] = ()) -> None:
+        self._write("set_keys", str(name), values, list(removed))
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self._log.tell() >= self.compact_threshold
+
+    def compact(self) -> None:
+        """Write a new snapshot and drop the log records it already contains. Safe to run in a thread."""
+        with self._compaction_lock:
+            with self._lock:
+                snapshot = json.dumps(self._data, ensure_ascii=False, indent=4)
+                self._log.close()
+                if not self.old_log_location.exists():
+                    os.replace(self.log_location, self.old_log_location)
+                else:
+                    # the old log is still needed, keep appending to it until the snapshot is written
+                    with self.log_location.open("r", encoding="utf-8") as src, \
+                            self.old_log_location.open("a", encoding="utf-8") as dst:
+                        dst.write(src.read())
+                    self.log_location.unlink()
+                self._log = self.log_location.open("a", encoding="utf-8")
+
+            tmp = self.location.with_name(self.location.name + ".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                f.write(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.location)
+            self.old_log_location.unlink(missing_ok=True)
+
+    def save(self) -> None:
+        self.compact()
+
+    def close(self) -> None:
+        self.compact()
+        self._log.close()
@@ -0,0 +1,114 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import asyncio
+import contextlib
+import hashlib
+import heapq
+import os
+import time
+import typing
+
+import jwt
+from loguru import logger
+
+from core.misc.lru import LRUCache
+
+# Tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_BEFORE = float(os.environ.get("TOKEN_REFRESH_BEFORE", 3 * 24 * 3600))
+# Seconds before another attempt if refreshing failed
+TOKEN_REFRESH_RETRY = float(os.environ.get("TOKEN_REFRESH_RETRY", 3600))
+
+_claims = LRUCache(int(os.environ.get("TOKEN_CLAIMS_CACHE_SIZE", 8192)))
+
+
+def token_hash(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+def token_claims(token: str) -> dict[str, typing.Any]:
+    """Claims of the JWT (not verified), decoded once per token"""
+    key = token_hash(token)
+    if (claims := _claims.get(key)) is None:
+        claims = jwt.decode(token, options={"verify_signature": False})
+        _claims.set(key, claims)
+    return claims
+
+
+class RefreshScheduler:
+    """
+    Tokens of users ordered by the time they should be refreshed at (min-heap).
+
+    ``run`` sleeps until the earliest one is due, so scheduling and refreshing a token is O(log N).
+    Entries of replaced tokens and rescheduled refreshes aren't removed from the heap, they are skipped when popped.
+    ``Database`` schedules tokens after writes of users are committed.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, str, bytes]] = []
+        self._scheduled: dict[str, tuple[bytes, float]] = {}  # user id -> (token hash, refresh at)
+        self._wakeup = asyncio.Event()
+
+    def schedule(self, user_id: str, token: typing.Optional[str], at: typing.Optional[float] = None) -> None:
+        """Refresh the token of the user ``TOKEN_REFRESH_BEFORE`` seconds before it expires (or at ``at``)"""
+        user_id = str(user_id)
+        if not token or token == "<TOKEN>":
+            self._scheduled.pop(user_id, None)
+            return
+
+        try:
+            expires_at = token_claims(token)["exp"]
+        except (jwt.PyJWTError, KeyError):
+            self._scheduled.pop(user_id, None)
+            return
+        if expires_at <= time.time():
+            # expired tokens can't be refreshed
+            self._scheduled.pop(user_id, None)
+            return
+
+        at = expires_at - TOKEN_REFRESH_BEFORE if at is None else at
+        self._scheduled[user_id] = (token_hash(token), at)
+        heapq.heappush(self._heap, (at, user_id, self._scheduled[user_id][0]))
+        if self._heap[0][1] == user_id:
+            self._wakeup.set()
+
+    def is_current(self, user_id: str, token: str) -> bool:
+        """Whether the refresh of this token (and not a replaced one) is scheduled for the user"""
+        scheduled = self._scheduled.get(str(user_id))
+        return scheduled is not None and scheduled[0] == token_hash(token)
+
+    def next_at(self) -> typing.Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    def __len__(self) -> int:
+        return len(self._scheduled)
+
+    async def run(self, refresh: typing.Callable[[str], typing.Awaitable]) -> None:
+        """Call ``refresh(user_id)`` for every due token, sleeping in between"""
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            if (delay := self._heap[0][0] - time.time()) > 0:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                continue
+
+            at, user_id, hash_ = heapq.heappop(self._heap)
+            if self._scheduled.get(user_id) != (hash_, at):
+                continue
+
+            # the token stays current while it is refreshed, so writes of the user don't schedule it again
+            try:
+                await refresh(user_id)
+            except Exception:
+                logger.exception(f"[RefreshScheduler] Failed to refresh the token of {user_id}")
+            if self._scheduled.get(user_id) == (hash_, at):
+                del self._scheduled[user_id]
+
+
+refresh_scheduler = RefreshScheduler()
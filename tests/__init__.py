@@ -0,0 +1,19 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import os
+import tempfile
+
+# the bot's config is read on import
+os.environ.setdefault("ADMINS", "1")
+os.environ.setdefault("ADMINS_CHAT_ID", "-1")
+
+# the database and logs are created in the working directory (texts are read from ``core/`` in it),
+# so tests run in a temporary one instead of touching files of the bot
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix="octodiary-tests-"))
+os.makedirs("files")
+os.makedirs("logs")
+os.symlink(os.path.join(ROOT, "core"), "core")
@@ -0,0 +1,36 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import datetime
+import unittest
+
+from core.services.api import DataType, UserData
+
+WEEKS = [datetime.date(2025, 3, 3), datetime.date(2025, 3, 10)]
+
+
+class SplitWeeksTestCase(unittest.TestCase):
+    def test_items_are_split_by_weeks(self):
+        response = {"response": [
+            {"id": 1, "start_at": "2025-03-04T08:30:00+03:00"},
+            {"id": 2, "start_at": "2025-03-11T08:30:00+03:00"},
+            {"id": 3, "start_at": "2025-03-18T08:30:00+03:00"},
+        ]}
+        weeks = UserData.split_weeks(DataType.EVENTS, response, WEEKS)
+
+        self.assertEqual([item["id"] for item in weeks[WEEKS[0]]["response"]], [1])
+        self.assertEqual([item["id"] for item in weeks[WEEKS[1]]["response"]], [2])
+        self.assertEqual(weeks[WEEKS[1]]["total_count"], 1)
+
+    def test_items_without_date_are_kept(self):
+        response = {"response": [{"id": 1, "start_at": None}, {"id": 2, "start_at": "2025-03-11T08:30:00+03:00"}]}
+        weeks = UserData.split_weeks(DataType.EVENTS, response, WEEKS)
+
+        self.assertEqual([item["id"] for item in weeks[WEEKS[0]]["response"]], [1])
+        self.assertEqual([item["id"] for item in weeks[WEEKS[1]]["response"]], [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
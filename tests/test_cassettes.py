@@ -0,0 +1,59 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import datetime
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+from core.misc.buffered import flusher
+from core.misc.cassettes import CassetteMissError, Cassettes, cassette_section
+
+URL = "https://school.mos.ru/api/family/mobile/v1/schedule"
+RECORDED = datetime.date(2025, 3, 5)  # Wednesday
+REPLAYED = RECORDED + datetime.timedelta(weeks=14, days=1)
+
+
+def params(today: datetime.date, student_id: int) -> dict:
+    monday = today - datetime.timedelta(days=today.weekday())
+    return {
+        "student_id": student_id,
+        "begin_date": (monday - datetime.timedelta(weeks=1)).isoformat(),
+        "end_date": (monday - datetime.timedelta(days=1)).isoformat(),
+    }
+
+
+class CassettesTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+
+    async def test_replay_on_later_date(self):
+        response = {
+            "response": [{"id": 1, "start_at": "2025-02-24T08:30:00+03:00", "author_name": "Иванов И.И."}],
+            "token": "secret",
+        }
+        with mock.patch("core.misc.cassettes.get_date", return_value=RECORDED), cassette_section("events"):
+            Cassettes("record", self.directory).record("GET", URL, params(RECORDED, 42), json.dumps(response))
+        flusher.flush()
+
+        cassettes = Cassettes("replay", self.directory)
+        with mock.patch("core.misc.cassettes.get_date", return_value=REPLAYED), cassette_section("events"):
+            replayed = json.loads(await cassettes.replay("GET", URL, params(REPLAYED, 7)))
+
+        self.assertEqual(replayed["response"][0]["start_at"], "2025-06-02T08:30:00+03:00")
+        self.assertEqual(replayed["response"][0]["author_name"], "*")
+        self.assertEqual(replayed["token"], "*")
+
+    async def test_unrecorded_request(self):
+        cassettes = Cassettes("replay", self.directory)
+        with mock.patch("core.misc.cassettes.get_date", return_value=REPLAYED), cassette_section("events"):
+            with self.assertRaises(CassetteMissError):
+                await cassettes.replay("GET", URL, params(REPLAYED, 7))
+        self.assertEqual(cassettes.misses, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import pickle
+import unittest
+
+from core.services import codecs
+from core.services.codecs import MAGIC, Codec
+
+VALUE = {"response": [{"id": 1, "subject_name": "Алгебра", "marks": [5, 4], "weight": 1.5, "homework": None}]}
+
+
+class CodecTestCase(unittest.TestCase):
+    def test_json_round_trip(self):
+        codec = Codec(format="json", compress_threshold=-1)
+        raw = codec.encode(VALUE)
+        self.assertTrue(raw.startswith(MAGIC))
+        self.assertEqual(codec.decode(raw), VALUE)
+
+    @unittest.skipUnless(codecs.msgpack, "msgpack isn't installed")
+    def test_msgpack_round_trip(self):
+        codec = Codec(format="msgpack", compress_threshold=-1)
+        self.assertEqual(codec.decode(codec.encode(VALUE)), VALUE)
+        self.assertEqual(Codec(format="json").decode(codec.encode(VALUE)), VALUE)
+
+    def test_compressed_round_trip(self):
+        codec = Codec(format="json", compress_threshold=16)
+        raw = codec.encode(VALUE | {"text": "a" * 1000})
+        self.assertLess(len(raw), 1000)
+        self.assertEqual(codec.decode(raw), VALUE | {"text": "a" * 1000})
+        # values shorter than the threshold aren't compressed
+        self.assertEqual(codec.decode(codec.encode({"id": 1})), {"id": 1})
+
+    def test_legacy_pickles_are_decoded(self):
+        self.assertEqual(Codec().decode(pickle.dumps(VALUE)), VALUE)
+
+    def test_unknown_version(self):
+        with self.assertRaises(ValueError):
+            Codec().decode(MAGIC + bytes((99, 0, 0)) + b"{}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import unittest
+
+from core.services.database import database
+
+
+class BatchTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.user = database.user("900001")
+        self.user.system = "mes"
+        self.user.token = "a"
+
+    def tearDown(self) -> None:
+        database.pop("900001")
+
+    def test_batch_is_saved_on_exception(self):
+        with self.assertRaises(ValueError), self.user.batch():
+            self.user.token = "b"
+            self.assertEqual(database.get_key("900001", "token"), "a")  # not saved yet
+            raise ValueError
+        self.assertEqual(self.user.token, "b")
+
+    def test_nested_batches_are_merged(self):
+        with self.user.batch() as outer, self.user.batch() as inner:
+            self.user.token = "b"
+        self.assertIs(outer, inner)
+        self.assertEqual(database.get_key("900001", "token"), "b")
+
+    async def test_transaction_is_rolled_back(self):
+        with self.assertRaises(ValueError):
+            async with self.user.transaction():
+                self.user.token = "b"
+                raise ValueError
+        self.assertEqual(self.user.token, "a")
+
+    async def test_transaction_is_rolled_back_within_batch(self):
+        with self.user.batch():
+            self.user.system = "myschool"
+            with self.assertRaises(ValueError):
+                async with self.user.transaction():
+                    self.user.token = "x"
+                    raise ValueError
+            self.assertEqual(self.user.token, "a")
+
+        self.assertEqual(self.user.token, "a")
+        self.assertEqual(self.user.system, "myschool")
+
+
+if __name__ == "__main__":
+    unittest.main()
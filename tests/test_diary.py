@@ -0,0 +1,103 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import datetime
+import unittest
+from unittest import mock
+
+from aiogram.types import CallbackQuery, User
+from octodiary.types.mobile import EventsResponse
+
+from core.handlers.diary import get_week
+from core.middlewares.renders import is_current_render, render_token, renders_middleware
+from core.services.api import DataType, UserData
+from core.services.database import database
+
+WEEK = [datetime.date(2025, 3, 3) + datetime.timedelta(days=i) for i in range(7)]
+EVENT = {
+    "id": 1,
+    "author_id": "1",
+    "title": "Математика",
+    "start_at": "2025-03-03T08:30:00+03:00",
+    "finish_at": "2025-03-03T09:15:00+03:00",
+    "source": "PLAN",
+    "class_unit_ids": [1, 2, 3],
+    "subject_id": 5,
+    "subject_name": "Алгебра",
+    "room_number": "101",
+}
+
+
+class FakeUserData:
+    def __init__(self, live: EventsResponse, cached: EventsResponse) -> None:
+        self.live = live
+        self.cached = cached
+
+    async def get(self, name: DataType, **kwargs):
+        return self.live
+
+    async def get_cached_week(self, name: DataType, week: datetime.date):
+        return self.cached, datetime.datetime(2025, 3, 3, 8, tzinfo=datetime.timezone.utc)
+
+    async def cache_week(self, name: DataType, week: datetime.date, model) -> None:
+        pass
+
+
+def cached(live: EventsResponse) -> EventsResponse:
+    return EventsResponse.model_validate(UserData.dump_week(DataType.EVENTS, live))
+
+
+class RevalidateTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch.object(database.redis, "_queue", [], create=True)
+        self.queue = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_unchanged_week_is_not_edited(self):
+        live = EventsResponse.model_validate({"total_count": 1, "response": [EVENT]})
+        self.assertNotEqual(cached(live), live)  # class_unit_ids aren't cached
+
+        response, _ = await get_week(FakeUserData(live, cached(live)), DataType.EVENTS, WEEK, "revalidate")
+        self.assertIsNone(response)
+        self.assertEqual(self.queue, [])
+
+    async def test_changed_week_is_edited(self):
+        live = EventsResponse.model_validate({"total_count": 1, "response": [EVENT]})
+        changed = EventsResponse.model_validate({"total_count": 1, "response": [{**EVENT, "room_number": "102"}]})
+
+        response, loaded_at = await get_week(FakeUserData(changed, cached(live)), DataType.EVENTS, WEEK, "revalidate")
+        self.assertIs(response, changed)
+        self.assertIsNone(loaded_at)
+        for coroutine in self.queue:
+            coroutine.close()
+
+
+def callback(data: str) -> CallbackQuery:
+    return CallbackQuery(
+        id=data,
+        from_user=User(id=1, is_bot=False, first_name="Test"),
+        chat_instance="1",
+        inline_message_id="message",
+        data=data,
+    )
+
+
+class RenderTokenTestCase(unittest.IsolatedAsyncioTestCase):
+    async def handle(self, call: CallbackQuery) -> int:
+        async def handler(event, data):
+            return render_token(event)
+
+        return await renders_middleware(handler, call, {})
+
+    async def test_token_changes_on_next_callback(self):
+        token = await self.handle(callback("diary:schedule:2025-03-03"))
+        self.assertTrue(is_current_render(callback("diary:schedule:2025-03-03"), token))
+
+        await self.handle(callback("page:2"))
+        self.assertFalse(is_current_render(callback("diary:schedule:2025-03-03"), token))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,203 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import redis
+
+from core.misc.buffered import flusher
+from core.services.storages import BaseStorage, JSONStorage, RedisStorage, SQLiteStorage, WALStorage
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+USER = {"system": "mes", "token": "token", "settings": {"notifications": {"create_mark": True}}}
+
+
+class StorageTests:
+    """Behaviour shared by all storages, ``open`` creates a storage of the tested backend"""
+
+    def setUp(self) -> None:
+        self.location = os.path.join(tempfile.mkdtemp(), "users_db.json")
+
+    def open(self) -> BaseStorage:
+        raise NotImplementedError
+
+    def reopen(self, storage: BaseStorage) -> BaseStorage:
+        storage.close()
+        return self.open()
+
+    def test_writes(self):
+        storage = self.open()
+        storage.set("1", dict(USER))
+        storage.set_key("1", "profile_id", 5)
+        storage.set_keys("1", {"scheduler": {"08:00": True}}, ["token"])
+        storage.set("2", {"system": "myschool"})
+        self.assertEqual(storage.pop_key("1", "profile_id"), 5)
+        self.assertEqual(storage.pop("2"), {"system": "myschool"})
+
+        expected = {"system": "mes", "settings": USER["settings"], "scheduler": {"08:00": True}}
+        self.assertEqual(storage.get("1"), expected)
+        self.assertNotIn("2", storage)
+        storage = self.reopen(storage)
+        self.assertEqual(storage.get("1"), expected)
+        storage.close()
+
+    def test_select(self):
+        storage = self.open()
+        storage.set("1", dict(USER))
+        storage.set("2", {"system": "myschool"})
+        storage.set("3", {})
+
+        self.assertEqual(sorted(storage.select()), ["1", "2"])
+        self.assertEqual(storage.select(system="mes", authorized=True, notifications=True), ["1"])
+        self.assertEqual(storage.select(authorized=False), ["2"])
+        storage.close()
+
+
+class JSONStorageTestCase(StorageTests, unittest.TestCase):
+    def open(self) -> BaseStorage:
+        return JSONStorage(self.location)
+
+    def reopen(self, storage: BaseStorage) -> BaseStorage:
+        storage.close()
+        flusher.flush()
+        return self.open()
+
+
+class WALStorageTestCase(StorageTests, unittest.TestCase):
+    def open(self) -> BaseStorage:
+        return WALStorage(self.location)
+
+    def test_torn_record_is_skipped(self):
+        storage = self.open()
+        storage.set("1", dict(USER))
+        storage.close()
+        with open(self.location + ".wal", "a", encoding="utf-8") as f:
+            f.write('["set_key", "1", "sys')
+
+        storage = self.open()
+        self.assertEqual(storage.get("1"), USER)
+        # later records aren't glued to the broken one
+        storage.set_key("1", "profile_id", 5)
+        storage = self.reopen(storage)
+        self.assertEqual(storage.get("1"), USER | {"profile_id": 5})
+        storage.close()
+
+    def test_compaction(self):
+        storage = self.open()
+        storage.set("1", dict(USER))
+        storage.set_key("1", "profile_id", 5)
+        storage.compact()
+
+        self.assertEqual(os.path.getsize(self.location + ".wal"), 0)
+        self.assertFalse(os.path.exists(self.location + ".wal.old"))
+        with open(self.location, encoding="utf-8") as f:
+            self.assertEqual(json.load(f), {"1": USER | {"profile_id": 5}})
+
+        storage.set_key("1", "profile_id", 6)
+        storage = self.reopen(storage)
+        self.assertEqual(storage.get("1"), USER | {"profile_id": 6})
+        storage.close()
+
+    def test_interrupted_compaction_is_finished(self):
+        storage = self.open()
+        storage.set("1", dict(USER))
+        storage.close()
+        # crashed after the log was rotated, before the snapshot was written
+        os.replace(self.location + ".wal", self.location + ".wal.old")
+
+        storage = self.open()
+        self.assertEqual(storage.get("1"), USER)
+        self.assertFalse(os.path.exists(self.location + ".wal.old"))
+        with open(self.location, encoding="utf-8") as f:
+            self.assertEqual(json.load(f), {"1": USER})
+        storage.close()
+
+
+class SQLiteStorageTestCase(StorageTests, unittest.TestCase):
+    def open(self) -> BaseStorage:
+        return SQLiteStorage(self.location)
+
+    def test_migration(self):
+        with open(self.location, "w", encoding="utf-8") as f:
+            json.dump({"1": USER | {"profile_id": 5}, "2": {"system": "myschool"}, "version": 2}, f)
+
+        storage = self.open()
+        self.assertEqual(storage.get("1"), USER | {"profile_id": 5})
+        self.assertEqual(storage.get("2"), {"system": "myschool"})
+        self.assertNotIn("version", storage)
+        self.assertEqual(storage.select(notifications=True), ["1"])
+
+        # migrated only once
+        storage.set("2", {"system": "mes"})
+        storage = self.reopen(storage)
+        self.assertEqual(storage.get("2"), {"system": "mes"})
+        storage.close()
+
+
+@unittest.skipUnless(fakeredis, "fakeredis isn't installed")
+class RedisStorageTestCase(StorageTests, unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.server = fakeredis.FakeServer()
+        patcher = mock.patch.object(redis.Redis, "from_url", lambda url: fakeredis.FakeRedis(server=self.server))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def open(self) -> BaseStorage:
+        return RedisStorage(self.location)
+
+    def test_migration(self):
+        with open(self.location, "w", encoding="utf-8") as f:
+            json.dump({"1": USER, "version": 2}, f)
+
+        storage = self.open()
+        self.assertEqual(dict(storage.items()), {"1": USER})
+        storage.close()
+
+
+@unittest.skipUnless(fakeredis, "fakeredis isn't installed")
+class RedisInvalidationsTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        server = fakeredis.FakeServer()
+        with mock.patch.object(redis.Redis, "from_url", lambda url: fakeredis.FakeRedis(server=server)):
+            self.storage, self.other = RedisStorage("users_db.json"), RedisStorage("users_db.json")
+        self.addCleanup(self.storage.close)
+        self.addCleanup(self.other.close)
+        self.client = fakeredis.FakeAsyncRedis(server=server)
+
+    async def test_writes_of_other_processes(self):
+        changed = []
+
+        async def listen():
+            async for key in self.storage.invalidations(self.client):
+                changed.append(key)
+
+        listener = asyncio.ensure_future(listen())
+        self.addCleanup(listener.cancel)
+        await asyncio.sleep(0.05)
+
+        self.storage.set("1", {"system": "mes"})
+        self.storage.flush()
+        await asyncio.sleep(0.05)
+        self.assertEqual(changed, [])
+
+        self.other.set_keys("1", {"token": "token"})
+        self.other.flush()
+        await asyncio.sleep(0.05)
+        self.assertEqual(changed, ["1"])
+        self.assertEqual(self.storage.get("1"), {"system": "mes", "token": "token"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import asyncio
+import time
+import unittest
+
+import jwt
+
+from core.services.tokens import TOKEN_REFRESH_BEFORE, RefreshScheduler
+
+SECRET = "octodiary-tests-secret-of-32-bytes"
+
+
+def token(expires_in: float, user: str = "1") -> str:
+    return jwt.encode({"exp": int(time.time() + expires_in), "sub": user}, SECRET, algorithm="HS256")
+
+
+class RefreshSchedulerTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.scheduler = RefreshScheduler()
+        self.refreshed = []
+
+    async def refresh(self, user_id: str) -> None:
+        self.refreshed.append(user_id)
+
+    async def run_scheduler(self) -> None:
+        runner = asyncio.ensure_future(self.scheduler.run(self.refresh))
+        await asyncio.sleep(0.05)
+        runner.cancel()
+
+    def test_schedule(self):
+        first = token(TOKEN_REFRESH_BEFORE + 100)
+        self.scheduler.schedule("1", first)
+        self.assertTrue(self.scheduler.is_current("1", first))
+        self.assertAlmostEqual(self.scheduler.next_at(), time.time() + 100, delta=2)
+
+        second = token(TOKEN_REFRESH_BEFORE + 200, "2")
+        self.scheduler.schedule("1", second)
+        self.assertFalse(self.scheduler.is_current("1", first))
+        self.assertTrue(self.scheduler.is_current("1", second))
+        self.assertEqual(len(self.scheduler), 1)
+
+    def test_unrefreshable_tokens_are_not_scheduled(self):
+        for value in (token(-10), "<TOKEN>", "not a jwt", None):
+            self.scheduler.schedule("1", token(TOKEN_REFRESH_BEFORE + 100))
+            self.scheduler.schedule("1", value)
+            self.assertEqual(len(self.scheduler), 0)
+
+    async def test_due_tokens_are_refreshed(self):
+        self.scheduler.schedule("1", token(100), at=time.time() - 1)
+        self.scheduler.schedule("2", token(TOKEN_REFRESH_BEFORE + 100))
+        await self.run_scheduler()
+
+        self.assertEqual(self.refreshed, ["1"])
+        self.assertEqual(len(self.scheduler), 1)
+
+    async def test_replaced_tokens_are_skipped(self):
+        self.scheduler.schedule("1", token(100), at=time.time() - 1)
+        self.scheduler.schedule("1", token(TOKEN_REFRESH_BEFORE + 100, "2"))
+        await self.run_scheduler()
+
+        self.assertEqual(self.refreshed, [])
+        self.assertEqual(len(self.scheduler), 1)
+
+    async def test_wakes_up_for_earlier_token(self):
+        self.scheduler.schedule("1", token(TOKEN_REFRESH_BEFORE + 100))
+        runner = asyncio.ensure_future(self.scheduler.run(self.refresh))
+        await asyncio.sleep(0.01)
+
+        self.scheduler.schedule("2", token(100, "2"), at=time.time())
+        await asyncio.sleep(0.05)
+        runner.cancel()
+        self.assertEqual(self.refreshed, ["2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
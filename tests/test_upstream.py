@@ -0,0 +1,192 @@
+#               © Copyright 2025
+#          Licensed under the MIT License
+#        https://opensource.org/licenses/MIT
+#           https://github.com/OctoDiary
+
+import asyncio
+import unittest
+from unittest import mock
+
+import aiohttp
+
+from core.misc import upstream
+from core.misc.upstream import (
+    AIMDLimiter,
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryBudget,
+    RetryPolicy,
+    Upstream,
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+)
+
+NO_DELAYS = RetryPolicy(attempts=3, base=0, cap=0)
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = Clock()
+        patcher = mock.patch.object(upstream.time, "monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("test", min_requests=4, error_rate=0.5, open_for=30)
+
+    def open(self) -> None:
+        for failed in (False, True, False, True):
+            self.breaker.acquire()
+            self.breaker.record(failed, 0.1)
+
+    def test_opens_on_errors(self):
+        for failed in (False, True, False):
+            self.breaker.acquire()
+            self.breaker.record(failed, 0.1)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+        self.breaker.record(True, 0.1)
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.acquire()
+        self.assertEqual(self.breaker.rejected, 1)
+
+    def test_old_requests_are_forgotten(self):
+        for failed in (True, True, False):
+            self.breaker.record(failed, 0.1)
+        self.clock.now += 31
+        self.breaker.record(True, 0.1)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_successful_probe_closes(self):
+        self.open()
+        self.clock.now += 30
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+
+        self.assertTrue(self.breaker.acquire())
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.acquire()
+        self.breaker.record(False, 0.1, probe=True)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_failed_probe_opens_again(self):
+        self.open()
+        self.clock.now += 30
+        self.breaker.record(True, 0.1, probe=self.breaker.acquire())
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.retry_in, 30)
+
+
+class AIMDLimiterTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_decreases_once_per_cooldown(self):
+        limiter = AIMDLimiter(limit=16, cooldown=60)
+        for _ in range(3):
+            await limiter.acquire()
+        for _ in range(3):
+            await limiter.release(True, 0.1)
+
+        self.assertEqual(limiter.limit, 8)
+        self.assertEqual(limiter.in_flight, 0)
+
+    async def test_slow_requests_decrease(self):
+        limiter = AIMDLimiter(limit=4, slow_call=5)
+        await limiter.acquire()
+        await limiter.release(False, 6)
+        self.assertEqual(limiter.limit, 2)
+
+    async def test_increases_when_saturated(self):
+        limiter = AIMDLimiter(limit=2)
+        await limiter.acquire()
+        await limiter.release(False, 0.1)
+        self.assertEqual(limiter.limit, 2)
+
+        for _ in range(2):
+            await limiter.acquire()
+        await limiter.release(False, 0.1)
+        self.assertEqual(limiter.limit, 2.5)
+
+    async def test_waits_for_a_slot(self):
+        limiter = AIMDLimiter(limit=1)
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        self.assertFalse(waiting.done())
+        self.assertEqual(limiter.waiting, 1)
+
+        await limiter.release(False, 0.1)
+        await asyncio.wait_for(waiting, 1)
+        self.assertEqual(limiter.in_flight, 1)
+
+
+class RetryBudgetTestCase(unittest.TestCase):
+    def test_retries_are_limited_by_requests(self):
+        budget = RetryBudget(ratio=0.5, max_tokens=2)
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        self.assertEqual(budget.exhausted, 1)
+
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+
+class UpstreamTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.upstream = Upstream("test", CircuitBreaker("test"), AIMDLimiter())
+        patcher = mock.patch.object(upstream, "retry_budget", RetryBudget())
+        self.budget = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def failing(errors: list[Exception], result: str = "ok"):
+        async def func():
+            if errors:
+                raise errors.pop(0)
+            return result
+        return func
+
+    async def test_failures_are_retried(self):
+        func = self.failing([aiohttp.ClientConnectionError(), asyncio.TimeoutError()])
+        self.assertEqual(await self.upstream.request(func, NO_DELAYS), "ok")
+        self.assertEqual(self.upstream.retries, 2)
+
+    async def test_other_errors_are_not_retried(self):
+        with self.assertRaises(ValueError):
+            await self.upstream.request(self.failing([ValueError()]), NO_DELAYS)
+        self.assertEqual(self.upstream.retries, 0)
+
+    async def test_retries_stop_without_budget(self):
+        self.budget.tokens = 1
+        with self.assertRaises(aiohttp.ClientConnectionError):
+            await self.upstream.request(
+                self.failing([aiohttp.ClientConnectionError(), aiohttp.ClientConnectionError()]),
+                NO_DELAYS
+            )
+        self.assertEqual(self.upstream.retries, 1)
+        self.assertEqual(self.budget.exhausted, 1)
+
+    async def test_slow_request_is_hedged(self):
+        self.upstream.latencies._p95 = 0.01
+        delays = [1, 0]
+
+        async def func():
+            await asyncio.sleep(delays.pop(0))
+            return "ok"
+
+        self.assertEqual(await asyncio.wait_for(self.upstream.request(func, RetryPolicy(hedge=True)), 0.5), "ok")
+        self.assertEqual(self.upstream.hedged, 1)
+        await asyncio.sleep(0)
+        self.assertEqual(self.upstream.limiter.in_flight, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()